@@ -0,0 +1,285 @@
+"""A minimal local stand-in for the Discord gateway and REST API.
+
+Only what the bot needs to log in, receive guilds and messages, and send, edit, delete and
+react to messages is implemented. The server runs on its own thread and event loop so its
+work does not show up as lag in the bot's loop.
+"""
+from collections import defaultdict
+import threading
+import datetime
+import asyncio
+import time
+import json
+import re
+
+from aiohttp import web
+
+DISCORD_EPOCH = 1420070400000
+ADMINISTRATOR = 8
+ID_PATTERN = re.compile(r'/\d{15,}')
+
+
+class Snowflakes:
+    def __init__(self):
+        self._increment = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self._increment = (self._increment + 1) % 4096
+            return (int(time.time() * 1000) - DISCORD_EPOCH) << 22 | self._increment
+
+
+def timestamp():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def json_response(data=None, status=200):
+    if data is None:
+        return web.Response(status=204)
+    # discord.py only decodes JSON when the content type is exactly this
+    return web.Response(body=json.dumps(data).encode(), status=status, headers={'Content-Type': 'application/json'})
+
+
+class FakeDiscord:
+    """Fake Discord with `guilds` guilds holding `channels` text channels and `members` members each.
+
+    `on_request(method, route, channel_id, payload)` is called on the server thread for every REST request.
+    """
+    def __init__(self, *, guilds=1, channels=1, members=2, on_request=None):
+        self.snowflake = Snowflakes()
+        self.on_request = on_request
+        self.user = self._user('LagBot', bot=True)
+        self.guilds = []
+        for guild_num in range(guilds):
+            guild_id = self.snowflake()
+            guild = {
+                'id': str(guild_id),
+                'name': f'Guild {guild_num}',
+                'owner_id': self.user['id'],
+                'region': 'us-east',
+                'afk_channel_id': None,
+                'afk_timeout': 300,
+                'verification_level': 0,
+                'default_message_notifications': 0,
+                'explicit_content_filter': 0,
+                'mfa_level': 0,
+                'features': [],
+                'emojis': [],
+                'roles': [{
+                    'id': str(guild_id),
+                    'name': '@everyone',
+                    'permissions': str(ADMINISTRATOR),
+                    'permissions_new': str(ADMINISTRATOR),  # what discord.py reads from API v7
+                    'position': 0,
+                    'color': 0,
+                    'hoist': False,
+                    'managed': False,
+                    'mentionable': False,
+                }],
+                'channels': [{
+                    'id': str(self.snowflake()),
+                    'type': 0,
+                    'name': f'channel-{num}',
+                    'position': num,
+                    'permission_overwrites': [],
+                    'nsfw': False,
+                    'parent_id': None,
+                } for num in range(channels)],
+                'members': [self._member(self.user)] + [
+                    self._member(self._user(f'Player {guild_num}-{num}')) for num in range(members)],
+                'voice_states': [],
+                'presences': [],
+                'large': False,
+                'unavailable': False,
+                'joined_at': timestamp(),
+            }
+            guild['member_count'] = len(guild['members'])
+            self.guilds.append(guild)
+        self._channel_guild = {c['id']: g['id'] for g in self.guilds for c in g['channels']}
+        self._sockets = []
+        self._seq = 0
+        self.loop = None
+        self.port = None
+        self._thread = None
+        self._runner = None
+        self._started = threading.Event()
+
+    def _user(self, name, bot=False):
+        return {'id': str(self.snowflake()), 'username': name, 'discriminator': '0001', 'avatar': None, 'bot': bot}
+
+    @staticmethod
+    def _member(user):
+        return {'user': user, 'roles': [], 'joined_at': timestamp(), 'deaf': False, 'mute': False}
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.port}/api/v7'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='fake-discord', daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+
+    def _run(self):
+        self.loop = loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        app = web.Application()
+        app.router.add_get('/gateway', self._gateway)
+        app.router.add_route('*', '/api/v7/{path:.*}', self._rest)
+        self._runner = web.AppRunner(app)
+        loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._started.set()
+        loop.run_forever()
+
+    # gateway
+
+    async def _send(self, ws, event, data):
+        self._seq += 1
+        await ws.send_str(json.dumps({'op': 0, 't': event, 's': self._seq, 'd': data}))
+
+    async def _gateway(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_str(json.dumps({'op': 10, 'd': {'heartbeat_interval': 41250}}))
+        async for msg in ws:
+            data = json.loads(msg.data)
+            op = data['op']
+            if op == 1:  # heartbeat
+                await ws.send_str(json.dumps({'op': 11}))
+            elif op == 2:  # identify
+                shard_id, shard_count = data['d'].get('shard', (0, 1))
+                guilds = [g for g in self.guilds if (int(g['id']) >> 22) % shard_count == shard_id]
+                await self._send(ws, 'READY', {
+                    'v': 6,
+                    'user': self.user,
+                    'guilds': [{'id': g['id'], 'unavailable': True} for g in guilds],
+                    'session_id': 'fake',
+                    'private_channels': [],
+                    'relationships': [],
+                    'application': {'id': self.user['id'], 'flags': 0},
+                })
+                for guild in guilds:
+                    await self._send(ws, 'GUILD_CREATE', guild)
+                self._sockets.append((ws, shard_id, shard_count))
+        self._sockets = [s for s in self._sockets if s[0] is not ws]
+        return ws
+
+    def send_message(self, channel_id, author, content):
+        """Dispatch a MESSAGE_CREATE from `author` (a member payload) in `channel_id`. Thread-safe."""
+        guild_id = self._channel_guild[channel_id]
+        mentions = []
+        for match in re.finditer(r'<@!?(\d+)>', content):
+            for guild in self.guilds:
+                for member in guild['members']:
+                    if member['user']['id'] == match.group(1):
+                        mentions.append(dict(member['user'], member=self._member(member['user'])))
+        data = self._message(channel_id, author['user'], content, mentions=mentions)
+        data['guild_id'] = guild_id
+        data['member'] = {k: v for k, v in author.items() if k != 'user'}
+
+        async def dispatch():
+            for ws, shard_id, shard_count in self._sockets:
+                if (int(guild_id) >> 22) % shard_count == shard_id:
+                    await self._send(ws, 'MESSAGE_CREATE', data)
+        asyncio.run_coroutine_threadsafe(dispatch(), self.loop)
+
+    def _message(self, channel_id, author, content='', embeds=(), mentions=()):
+        return {
+            'id': str(self.snowflake()),
+            'channel_id': channel_id,
+            'guild_id': self._channel_guild.get(channel_id),
+            'author': author,
+            'content': content or '',
+            'timestamp': timestamp(),
+            'edited_timestamp': None,
+            'tts': False,
+            'mention_everyone': False,
+            'mentions': list(mentions),
+            'mention_roles': [],
+            'attachments': [],
+            'embeds': list(embeds),
+            'pinned': False,
+            'type': 0,
+        }
+
+    # REST
+
+    async def _rest(self, request):
+        path = '/' + request.match_info['path']
+        method = request.method
+        payload = None
+        if request.can_read_body:
+            try:
+                payload = await request.json()
+            except ValueError:
+                payload = None
+        parts = path.strip('/').split('/')
+        channel_id = parts[1] if parts[0] == 'channels' and len(parts) > 1 else None
+        route = ID_PATTERN.sub('/{id}', path)
+        if self.on_request is not None:
+            self.on_request(method, route, channel_id, payload)
+
+        if path == '/users/@me':
+            return json_response(self.user)
+        elif path == '/gateway':
+            return json_response({'url': f'ws://127.0.0.1:{self.port}/gateway'})
+        elif path == '/gateway/bot':
+            return json_response({'url': f'ws://127.0.0.1:{self.port}/gateway', 'shards': 1,
+                                  'session_start_limit': {'total': 1000, 'remaining': 1000,
+                                                          'reset_after': 0, 'max_concurrency': 1}})
+        elif path == '/oauth2/applications/@me':
+            return json_response({
+                'id': self.user['id'], 'name': 'LagBot', 'icon': None, 'description': '', 'rpc_origins': [],
+                'bot_public': True, 'bot_require_code_grant': False, 'owner': self._user('Owner'), 'team': None,
+                'summary': '', 'verify_key': '',
+            })
+        elif channel_id is not None and len(parts) >= 3 and parts[2] == 'messages':
+            payload = payload or {}
+            embeds = [payload['embed']] if payload.get('embed') else []
+            if method == 'POST' and len(parts) == 3:
+                return json_response(self._message(channel_id, self.user, payload.get('content'), embeds))
+            elif method == 'PATCH':
+                data = self._message(channel_id, self.user, payload.get('content'), embeds)
+                data['id'] = parts[3]
+                data['edited_timestamp'] = timestamp()
+                return json_response(data)
+        return json_response()
+
+
+class RequestLog:
+    """Counts REST requests and times board updates against the messages that caused them."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = defaultdict(int)  # {(method, route): count}
+        self.pending = defaultdict(list)  # {channel ID: [send time]}
+        self.latencies = []
+        self.recording = False
+
+    def sent(self, channel_id):
+        with self.lock:
+            if self.recording:
+                self.pending[channel_id].append(time.perf_counter())
+
+    def __call__(self, method, route, channel_id, payload):
+        now = time.perf_counter()
+        with self.lock:
+            if not self.recording:
+                return
+            self.requests[method, route] += 1
+            board = method == 'PATCH' or (method == 'POST' and payload and payload.get('embed'))
+            if board and channel_id in self.pending:
+                self.latencies.extend(now - sent for sent in self.pending.pop(channel_id))
+
+    @property
+    def unanswered(self):
+        return sum(len(p) for p in self.pending.values())
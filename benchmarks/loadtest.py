@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""End-to-end load test of LagBot against a local fake Discord.
+
+Boots `LagBot` with the real `cogs.meta` and `cogs.smash` extensions, connects it to
+`fake_discord.FakeDiscord`, and either generates a scripted stream of smash games or replays
+a recorded one. Reports message-to-board-update latency, REST calls per command and event
+loop lag.
+
+A recorded stream is JSON lines of `{"at": seconds, "channel": index, "author": index, "content": str}`,
+where `channel` indexes every channel and `author` indexes the members of that channel's guild.
+
+Usage:
+    python benchmarks/loadtest.py --channels 20 --players 4 --rate 50 --duration 30
+    python benchmarks/loadtest.py --replay stream.jsonl
+"""
+import importlib.machinery
+import importlib.util
+import statistics
+import argparse
+import asyncio
+import logging
+import random
+import json
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_discord import FakeDiscord, RequestLog  # NOQA: E402
+
+
+def load_config(**overrides):
+    """Use `config.py.example` as the bot's config, so the real token and local files are never touched."""
+    path = os.path.join(ROOT, 'config.py.example')
+    spec = importlib.util.spec_from_loader('config', importlib.machinery.SourceFileLoader('config', path))
+    config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(config)
+    for name in dir(config):
+        if name.startswith('smash_') and isinstance(getattr(config, name), str):
+            setattr(config, name, None)  # disable journal and history files
+    config.token = 'fake'
+    config.source = None
+    config.metrics_file = None
+    config.app_info_cache = None
+    config.settings_db = None
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    sys.modules['config'] = config
+    return config
+
+
+def generate(channels, players, rate, duration, seed=0):
+    """Script a smash game per channel, then random picks and wins at `rate` messages per second overall."""
+    rng = random.Random(seed)
+    # change a game default first, so the settings commands are exercised too
+    stream = [{'at': 0, 'channel': 0, 'author': 0, 'content': ',defaults inactivity 15'}]
+    for channel in range(channels):
+        members = range(channel * players, (channel + 1) * players)
+        mentions = ' '.join(f'{{member:{m}}}' for m in members)
+        stream.append({'at': channel / channels, 'channel': channel, 'author': members[0],
+                       'content': f',smash {mentions}'})
+    # each player alternates between picking and (sometimes) winning so every command changes the board
+    picked = {}
+    at = 1.0
+    step = 1 / rate
+    while at < duration:
+        channel = rng.randrange(channels)
+        author = channel * players + rng.randrange(players)
+        if picked.get(author) and rng.random() < 0.5:
+            content = 'w'
+            picked[author] = False
+        else:
+            content = 'p'
+            picked[author] = True
+        stream.append({'at': at, 'channel': channel, 'author': author, 'content': content})
+        at += step
+    return stream
+
+
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return {}
+    values = sorted(values)
+    result = {f'p{p}': values[min(len(values) - 1, int(len(values) * p / 100))] * 1000 for p in points}
+    result['max'] = values[-1] * 1000
+    result['mean'] = statistics.mean(values) * 1000
+    return result
+
+
+async def sample_lag(samples, interval=0.05):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - start - interval))
+
+
+async def run(args, stream):
+    from lagbot import LagBot, ShardedLagBot
+
+    channels = max(e['channel'] for e in stream) + 1
+    authors = max(e['author'] for e in stream) + 1
+    guild_count = min(args.guilds, channels)
+    per_guild = -(-channels // guild_count)
+    log = RequestLog()
+    server = FakeDiscord(guilds=guild_count, channels=per_guild, members=authors, on_request=log)
+    server.start()
+
+    import discord
+    discord.http.Route.BASE = server.base_url
+
+    if args.shards:
+        bot = ShardedLagBot(guild_ready_timeout=0.1, shard_count=args.shards, shard_ids=range(args.shards))
+    else:
+        bot = LagBot(guild_ready_timeout=0.1)
+    for ext in ('cogs.meta', 'cogs.smash'):
+        bot.load_extension(ext)
+    bot_task = asyncio.ensure_future(bot.start('fake'))
+    await asyncio.wait_for(bot.wait_until_ready(), 30)
+
+    channel_ids = [c['id'] for g in server.guilds for c in g['channels']]
+    guild_of = {c['id']: g for g in server.guilds for c in g['channels']}
+
+    def author_of(channel_id, index):
+        return guild_of[channel_id]['members'][1 + index]  # first member is the bot
+
+    lag = []
+    lag_task = asyncio.ensure_future(sample_lag(lag))
+    log.recording = True
+    commands = 0
+    start = time.perf_counter()
+    for event in stream:
+        delay = start + event['at'] / args.speed - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        channel_id = channel_ids[event['channel']]
+        content = event['content']
+        if '{member:' in content:
+            content = content.format_map(MemberMentions(lambda i: author_of(channel_id, i)))
+        log.sent(channel_id)
+        server.send_message(channel_id, author_of(channel_id, event['author']), content)
+        commands += 1
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(args.settle)
+    log.recording = False
+    lag_task.cancel()
+
+    with log.lock:
+        requests = dict(log.requests)
+        latencies = list(log.latencies)
+        unanswered = log.unanswered
+    total_requests = sum(requests.values())
+    report = {
+        'commands': commands,
+        'seconds': elapsed,
+        'commands_per_second': commands / elapsed if elapsed else None,
+        'board_latency_ms': percentiles(latencies),
+        'unanswered_commands': unanswered,
+        'command_errors': {f'{name} ({error})': n for (name, error), n in bot.metrics.errors.values.items()},
+        'api_calls': total_requests,
+        'api_calls_per_command': total_requests / commands if commands else None,
+        'api_calls_by_route': {f'{m} {r}': n for (m, r), n in sorted(requests.items(), key=lambda i: -i[1])},
+        'loop_lag_ms': percentiles(lag),
+        'bot_reply_ms': {f'{name} ({via})': {f'p{q}': round(bot.metrics.reply_seconds.quantile(q / 100, command=name,
+                                                                                               via=via) * 1000, 3)
+                                            for q in (50, 99)}
+                         for name, via in bot.metrics.reply_seconds.keys()},
+    }
+
+    await bot.close()
+    try:
+        await bot_task
+    except Exception:
+        pass
+    server.stop()
+    return report
+
+
+class MemberMentions(dict):
+    """Format `{member:N}` placeholders as mentions of the Nth member."""
+    def __init__(self, member):
+        super().__init__()
+        self.member = member
+
+    def __missing__(self, key):
+        return _MentionFormatter(self.member)
+
+
+class _MentionFormatter:
+    def __init__(self, member):
+        self.member = member
+
+    def __format__(self, spec):
+        return f'<@{self.member(int(spec))["user"]["id"]}>'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--channels', type=int, default=10, help='channels, each running one game')
+    parser.add_argument('--players', type=int, default=4, help='players per game')
+    parser.add_argument('--guilds', type=int, default=1, help='guilds to spread channels over')
+    parser.add_argument('--shards', type=int, help='run the bot auto-sharded with this many shards')
+    parser.add_argument('--rate', type=float, default=20, help='messages per second across all channels')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of scripted messages')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--replay', help='replay a recorded JSON lines stream instead of scripting one')
+    parser.add_argument('--record', help='save the scripted stream to this file')
+    parser.add_argument('--speed', type=float, default=1, help='replay speed multiplier')
+    parser.add_argument('--settle', type=float, default=3, help='seconds to wait for the bot to catch up')
+    parser.add_argument('--edit-window', type=float, help='override smash_edit_window')
+    parser.add_argument('--output', '-o', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    overrides = {}
+    if args.edit_window is not None:
+        overrides['smash_edit_window'] = args.edit_window
+    load_config(**overrides)
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.replay:
+        with open(args.replay) as f:
+            stream = [json.loads(line) for line in f if line.strip()]
+    else:
+        stream = generate(args.channels, args.players, args.rate, args.duration, args.seed)
+        if args.record:
+            with open(args.record, 'w') as f:
+                f.writelines(json.dumps(e) + '\n' for e in stream)
+
+    loop = asyncio.get_event_loop()
+    report = loop.run_until_complete(run(args, stream))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
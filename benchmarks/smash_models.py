@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""Microbenchmarks for the smash game models.
+
+Runs without a Discord connection using lightweight stand-ins for members, messages and the cog.
+
+Usage:
+    python benchmarks/smash_models.py [--quick] [--output results.json] [--baseline old.json]
+"""
+from types import SimpleNamespace
+import importlib.machinery
+import importlib.util
+import statistics
+import argparse
+import datetime
+import platform
+import random
+import json
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    import config  # NOQA
+except ImportError:  # models import the cog package, which needs a config
+    path = os.path.join(ROOT, 'config.py.example')
+    spec = importlib.util.spec_from_loader('config', importlib.machinery.SourceFileLoader('config', path))
+    sys.modules['config'] = config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(config)
+
+from cogs.smash.models import Game, Fighter, FakeFighter, MODES  # NOQA: E402
+from utils import deep_sizeof  # NOQA: E402
+
+PLAYER_COUNTS = (2, 4, 8, 16, 25)
+ROUND_COUNTS = (10, 50, 100, 300)
+QUICK_PLAYER_COUNTS = (2, 25)
+QUICK_ROUND_COUNTS = (10, 100)
+
+
+class FakeMember:
+    def __init__(self, id):
+        self.id = id
+        self.name = self.display_name = f'Player {id}'
+        self.mention = f'<@{id}>'
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id
+
+
+class FakeInactivity:
+    def add(self, game):
+        pass
+
+    touch = discard = add
+
+
+def fake_cog():
+    bot = SimpleNamespace(loop=None)
+    return SimpleNamespace(bot=bot, players={}, inactivity=FakeInactivity(), history=None, journal=None)
+
+
+def make_game(mode, player_count, round_count, seed=0):
+    """Build a game where every player has played `round_count` rounds of random fighters."""
+    rng = random.Random(seed)
+    fighters = list(Fighter.all())
+    members = [FakeMember(i) for i in range(player_count)]
+    game = Game(fake_cog(), 0, None, MODES[mode], members, 0, None, datetime.datetime(2020, 1, 1))
+    for player in game.players.values():
+        for _ in range(round_count):
+            player.play(rng.choice(fighters))
+            if rng.random() < 0.5:
+                player.win()
+    for player in list(game.players.values())[:3]:
+        fighter = rng.choice(fighters)
+        if not game.is_banned(fighter):
+            player.ban(fighter)
+    return game
+
+
+def timeit(func, *, repeat=5, min_time=0.05):
+    """Return per-call timings in microseconds, calibrating the loop count so each repeat takes `min_time`."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return [t * 1e6 for t in timings], number
+
+
+def bench_get_closest():
+    names = [f.name.lower() for f in Fighter.all()]
+    typos = [n[:-1] for n in names] + ['not a fighter', 'zzz']
+    numbers = [f.number for f in Fighter.all()]
+
+    def cold():
+        Fighter._lookup.cache_clear()
+        for name in typos:
+            try:
+                Fighter.get_closest(name)
+            except Exception:
+                pass
+
+    def warm():
+        for name in names:
+            Fighter.get_closest(name)
+
+    def by_number():
+        for num in numbers:
+            Fighter.get_closest(num)
+
+    yield 'get_closest.cold', {'names': len(typos)}, cold
+    yield 'get_closest.warm', {'names': len(names)}, warm
+    yield 'get_closest.number', {'names': len(numbers)}, by_number
+
+
+def bench_player(player_counts, round_counts):
+    fighter = next(Fighter.all())
+    for rounds in round_counts:
+        game = make_game('smash', 2, rounds)
+        player = next(iter(game.players.values()))
+
+        def play_win_undo():
+            player.play(fighter)
+            player.win()
+            player.undo()
+            player.undo()
+
+        def insert_undo():
+            player.play(fighter, 0)
+            player.undo('play', 0)
+
+        yield 'player.play_win_undo', {'rounds': rounds}, play_win_undo
+        yield 'player.insert_undo', {'rounds': rounds}, insert_undo
+
+
+def bench_modes(player_counts, round_counts):
+    fighters = list(Fighter.all())
+    for mode in MODES:
+        for players in player_counts:
+            for rounds in round_counts:
+                game = make_game(mode, players, rounds)
+                player = next(iter(game.players.values()))
+                checks = game.mode
+
+                def pick_check():
+                    for f in fighters:
+                        checks.pick_check(player, f)
+
+                def ban_check():
+                    for f in fighters:
+                        checks.ban_check(player, f)
+
+                def random_pick():
+                    allowed = checks.pick_mask(player)
+                    if allowed:
+                        Fighter.random(allowed)
+
+                params = {'mode': mode, 'players': players, 'rounds': rounds}
+                yield 'mode.pick_check', params, pick_check
+                yield 'mode.ban_check', params, ban_check
+                yield 'mode.random_pick', params, random_pick
+
+
+def bench_embed(player_counts, round_counts):
+    fighter = next(Fighter.all())
+    for players in player_counts:
+        for rounds in round_counts:
+            game = make_game('smash', players, rounds)
+            player = next(iter(game.players.values()))
+
+            def cold():
+                game._embed = game._description = None
+                for p in game.players.values():
+                    p._field_changed()
+                game.embed
+
+            def after_play():
+                player.play(fighter)
+                game.embed
+                player.undo()
+
+            def unchanged():
+                game.embed
+
+            params = {'players': players, 'rounds': rounds}
+            yield 'embed.cold', params, cold
+            yield 'embed.after_play', params, after_play
+            yield 'embed.unchanged', params, unchanged
+
+
+def measure_memory(player_counts, round_counts):
+    """Bytes held by a game with its board rendered, not counting shared fighters, modes, members or the cog."""
+    shared = [*Fighter.all(), *(FakeFighter(name) for name in FakeFighter.names), *MODES.values()]
+    results = []
+    for players in player_counts:
+        for rounds in round_counts:
+            game = make_game('smash', players, rounds)
+            game.embed
+            seen = {id(o) for o in (*shared, *game.players, game.cog)}
+            size = deep_sizeof(game, seen)
+            result = {
+                'name': 'memory.game',
+                'params': {'players': players, 'rounds': rounds},
+                'bytes': size,
+                'bytes_per_round': size / (players * rounds),
+            }
+            results.append(result)
+            print(f'{key(result):60} {size:12}B {result["bytes_per_round"]:8.1f}B/round', file=sys.stderr)
+    return results
+
+
+def run(quick=False, only=None):
+    player_counts = QUICK_PLAYER_COUNTS if quick else PLAYER_COUNTS
+    round_counts = QUICK_ROUND_COUNTS if quick else ROUND_COUNTS
+    suites = (bench_get_closest(),
+              bench_player(player_counts, round_counts),
+              bench_modes(player_counts, round_counts),
+              bench_embed(player_counts, round_counts))
+    results = []
+    for suite in suites:
+        for name, params, func in suite:
+            if only and only not in name:
+                continue
+            timings, number = timeit(func, repeat=3 if quick else 5)
+            result = {
+                'name': name,
+                'params': params,
+                'min_us': min(timings),
+                'median_us': statistics.median(timings),
+                'loops': number,
+            }
+            results.append(result)
+            print(f'{key(result):60} {result["median_us"]:12.2f}us', file=sys.stderr)
+    return results
+
+
+def key(result):
+    params = ','.join(f'{k}={v}' for k, v in result['params'].items())
+    return f'{result["name"]}[{params}]'
+
+
+def compare(results, memory, baseline, threshold):
+    """Print the ratio of each result and memory size to the baseline, returning the keys worse than `threshold`."""
+    old = {key(r): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        k = key(result)
+        if k not in old:
+            continue
+        ratio = result['median_us'] / old[k]['median_us']
+        flag = ''
+        if ratio > threshold:
+            flag = ' REGRESSION'
+            regressions.append(k)
+        print(f'{k:60} {ratio:6.2f}x{flag}')
+    old = {key(r): r for r in baseline.get('memory', [])}  # older results have no memory section
+    for result in memory:
+        k = key(result)
+        if k not in old:
+            continue
+        ratio = result['bytes'] / old[k]['bytes']
+        flag = ''
+        if ratio > threshold:
+            flag = ' REGRESSION'
+            regressions.append(k)
+        print(f'{k:60} {ratio:6.2f}x {old[k]["bytes"]:>10}B -> {result["bytes"]:>10}B{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='run a reduced sweep')
+    parser.add_argument('--only', help='only run benchmarks whose name contains this')
+    parser.add_argument('--output', '-o', help='write results as JSON to this file instead of stdout')
+    parser.add_argument('--baseline', '-b', help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown or memory growth ratio against the baseline counted as a regression')
+    args = parser.parse_args()
+
+    results = run(quick=args.quick, only=args.only)
+    memory = []
+    if not args.only or args.only in 'memory.game':
+        memory = measure_memory(QUICK_PLAYER_COUNTS if args.quick else PLAYER_COUNTS,
+                                QUICK_ROUND_COUNTS if args.quick else ROUND_COUNTS)
+    output = {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'time': datetime.datetime.utcnow().isoformat(),
+        },
+        'results': results,
+        'memory': memory,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, memory, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
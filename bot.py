@@ -1,10 +1,16 @@
 #!/usr/bin/env python3
+import argparse
 import logging
+import time
 import sys
 
-from discord.ext import commands
+started = time.perf_counter()  # the standard library imports above take next to no time, time the rest
 
-from lagbot import LagBot
+from discord.ext import commands  # NOQA: E402
+
+from lagbot import LagBot, ShardedLagBot  # NOQA: E402
+from utils import Timeline  # NOQA: E402
+import config  # NOQA: E402
 
 # stolen from R.Danny
 try:
@@ -16,16 +22,38 @@ else:
 
 logging.basicConfig(level=logging.WARNING)
 
-initial_cogs = ['cogs.meta', 'cogs.smash', 'jishaku']
+initial_cogs = ['cogs.meta', 'cogs.smash']
+lazy_cogs = {'jishaku': ('jishaku', 'jsk')}  # {extension: command names}, loaded on first use
+
+
+def shard_range(arg):
+    """Parse shard IDs given as `3` or `0-3`."""
+    first, _, last = arg.partition('-')
+    return range(int(first), int(last or first) + 1)
+
 
 if __name__ == '__main__':
-    bot = LagBot()
+    startup = Timeline(started)
+    startup.mark('import')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shard-ids', type=shard_range, help='run these shards, e.g. 0-3, as a cluster worker')
+    parser.add_argument('--shard-count', type=int, help='total shards in the cluster')
+    args = parser.parse_args()
+
+    if args.shard_ids is not None:
+        bot = ShardedLagBot(shard_ids=args.shard_ids, shard_count=args.shard_count, startup=startup)
+    else:
+        bot = (ShardedLagBot if config.sharded else LagBot)(startup=startup)
 
     for cog in initial_cogs:
         try:
             bot.load_extension(cog)
         except commands.ExtensionError:
             logging.exception(f"Couldn't load cog {cog}")
+    for cog, names in lazy_cogs.items():
+        bot.add_lazy_extension(cog, *names)
+    startup.mark('extensions')
 
     status = bot.run()
     logging.critical(f'Exiting with {status}.')
@@ -1,9 +1,20 @@
+import logging
+import math
+import time
+
 from discord.ext import commands
 import discord
 
+from membercache import memory_report
+from utils import pluralize
 import config
 
 
+def format_latency(latency):
+    """Format a gateway latency, which is not a number until the first heartbeat is acknowledged."""
+    return f'{int(latency * 1000)}ms' if math.isfinite(latency) else '?ms'
+
+
 class Meta(commands.Cog):
     """Commands that are related to the bot itself."""
     def __init__(self, bot):
@@ -24,6 +35,22 @@ class Meta(commands.Cog):
         self.bot.exit_status = code
         await self.bot.logout()
 
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def reload(self, ctx, extension='cogs.smash'):
+        """Reload an extension in place.
+
+        Smash games in progress carry on in the reloaded cog.
+        """
+        start = time.perf_counter()
+        try:
+            self.bot.reload_extension(extension)
+        except commands.ExtensionError as e:
+            logging.exception(f"Couldn't reload {extension}")
+            await ctx.send(f'Failed reloading {extension}: {e}')
+            return
+        await ctx.send(f'Reloaded {extension} in {(time.perf_counter() - start) * 1000:.0f}ms.')
+
     @commands.group(hidden=True)
     @commands.is_owner()
     async def manage(self, ctx):
@@ -59,6 +86,58 @@ class Meta(commands.Cog):
                 new_avatar = await ctx.message.attachments[0].read()
             await self.bot.user.edit(avatar=new_avatar)
 
+    @commands.group(invoke_without_command=True)
+    @commands.guild_only()
+    async def prefix(self, ctx):
+        """Show this server's command prefix."""
+        prefix = self.bot.settings.get(ctx.guild.id, 'prefix', config.prefix)
+        await ctx.send(f'The prefix here is `{prefix}`, or mention me.')
+
+    @prefix.command(name='set')
+    @commands.guild_only()
+    @commands.has_guild_permissions(manage_guild=True)
+    async def prefix_set(self, ctx, *, new_prefix):
+        """Change this server's command prefix."""
+        if len(new_prefix) > 20:
+            await ctx.send('The prefix may be at most 20 characters.')
+            return
+        self.bot.settings.set(ctx.guild.id, 'prefix', None if new_prefix == config.prefix else new_prefix)
+        await ctx.send(f'The prefix is now `{new_prefix}`.')
+
+    @prefix.command(name='reset')
+    @commands.guild_only()
+    @commands.has_guild_permissions(manage_guild=True)
+    async def prefix_reset(self, ctx):
+        """Reset this server's command prefix to the default."""
+        self.bot.settings.set(ctx.guild.id, 'prefix', None)
+        await ctx.send(f'The prefix is now `{config.prefix}`.')
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def startup(self, ctx):
+        """Show how long each phase of starting up took."""
+        lines, previous = [], 0
+        for phase, at in self.bot.startup:
+            lines.append(f'{phase:<14} {at * 1000:>8.0f}ms  (+{(at - previous) * 1000:.0f}ms)')
+            previous = at
+        lines = '\n'.join(lines)
+        await ctx.send(f'```\n{lines}\n```')
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def memory(self, ctx):
+        """Show approximate memory held by the member, message and guild caches."""
+        lines = [f'{"cache":<10} {"count":>9} {"MiB":>8}']
+        total = 0
+        for name, count, size in memory_report(self.bot):
+            lines.append(f'{name:<10} {count:>9} {size / 2 ** 20:>8.2f}')
+            total += size
+        lines.append(f'{"total":<10} {"":>9} {total / 2 ** 20:>8.2f}')
+        cache = self.bot.member_cache
+        lines.append(f'\nMember cache: {cache.policy}, chunking: {config.member_chunking}')
+        lines = '\n'.join(lines)
+        await ctx.send(f'```\n{lines}\n```')
+
     @property
     def oauth_url(self):
         perms = discord.Permissions()
@@ -71,6 +150,7 @@ class Meta(commands.Cog):
     @commands.command()
     async def invite(self, ctx):
         """Add bot to one of your servers."""
+        await self.bot.wait_for_app_info()
         desc = '\n'.join([
             'Follow this link, login if necessary, then select a server you moderate to add me to.',
             'The requested permissions are required for some of my commands to function.'])
@@ -80,14 +160,22 @@ class Meta(commands.Cog):
     @commands.command()
     async def about(self, ctx):
         """Display bot information."""
+        app = await self.bot.wait_for_app_info()
         description = f'Uptime: {self.bot.get_uptime(brief=True)}'
         embed = discord.Embed(title='Invite me to your server!', url=self.oauth_url, description=description)
-        app = self.bot.app
         if app.team:
             embed.add_field(name='Team', value='\n'.join(str(m) for m in app.team.members))
         else:
             embed.set_author(name=str(app.owner), icon_url=app.owner.avatar_url)
         embed.add_field(name='Guilds', value=str(len(self.bot.guilds)))
+        shards = self.bot.shard_stats()
+        if shards[0][0] is not None:
+            lines = [f'#{shard_id}: {format_latency(latency)}, {pluralize("guild", "guilds", guilds)}'
+                     for shard_id, latency, guilds in shards]
+            value = '\n'.join(lines)
+            if len(value) > 1024:
+                value = value[:1024].rsplit('\n', 1)[0]
+            embed.add_field(name=f'Shards ({self.bot.shard_count})', value=value)
         source = config.source
         if source:
             embed.add_field(name='Source', value=f'See [here]({source}).')
@@ -95,10 +183,54 @@ class Meta(commands.Cog):
         embed.timestamp = self.bot.start_time
         await ctx.send(embed=embed)
 
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def metrics(self, ctx):
+        """Show command latency, API usage and event loop lag.
+
+        This is the bot's stats command, named metrics as smash already has a stats command for players.
+        """
+        metrics = self.bot.metrics
+
+        def ms(seconds):
+            return '-' if seconds is None else f'{seconds * 1000:.1f}'
+
+        def spread(histogram, **labels):
+            return f'{ms(histogram.quantile(.5, **labels))}/{ms(histogram.quantile(.99, **labels))}'
+
+        lines = [f'{"command":<18} {"count":>6} {"reply p50/p99":>15} {"own p50/p99":>13} {"errors":>6}']
+        errors = {}
+        for (name, _), count in metrics.errors.values.items():
+            errors[name] = errors.get(name, 0) + count
+        for (name, via), count in sorted(metrics.commands.values.items(), key=lambda i: -i[1]):
+            reply = spread(metrics.reply_seconds, command=name, via=via)
+            own = spread(metrics.own_seconds, command=name, via=via)
+            label = name if via == 'prefix' else f'{name} ({via})'
+            error_count = errors.pop(name, '')
+            lines.append(f'{label:<18} {count:>6} {reply:>15} {own:>13} {error_count:>6}')
+        failed = sum(n for (_, _, status), n in metrics.api_requests.values.items() if status != 'ok')
+        lines.append('')
+        lines.append(f'API requests: {metrics.api_requests.total()} ({failed} failed)')
+        lag = metrics.loop_lag
+        lines.append(f'Loop lag: p50 {ms(lag.quantile(.5))}ms, p99 {ms(lag.quantile(.99))}ms, max {ms(lag.max())}ms')
+        gauges = [m for m in metrics.metrics.values() if m.type == 'gauge']
+        lines.append(' | '.join(f'{g.name[len(metrics.prefix):]}: {sum(g.read().values())}' for g in gauges))
+        text = '\n'.join(lines)
+        if len(text) > 1990:
+            text = text[:1990].rsplit('\n', 1)[0]
+        await ctx.send(f'```\n{text}\n```')
+
     @commands.command()
     async def ping(self, ctx):
         """Make sure bot is working."""
-        await ctx.send(f'Pong! Latency: {int(self.bot.latency * 1000)}ms')
+        shards = self.bot.shard_stats()
+        if shards[0][0] is None:
+            await ctx.send(f'Pong! Latency: {format_latency(self.bot.latency)}')
+            return
+        lines = [f'Pong! This server is on shard {ctx.guild.shard_id if ctx.guild else 0} of {self.bot.shard_count}.']
+        lines.extend(f'Shard {shard_id}: {format_latency(latency)}, {pluralize("guild", "guilds", guilds)}'
+                     for shard_id, latency, guilds in shards)
+        await ctx.send('\n'.join(lines)[:2000])
 
 
 def setup(bot):
@@ -1,6 +1,9 @@
-import random
+import contextvars
+import functools
+import logging
 import typing
 
+from discord.ext.commands.view import StringView
 from discord.ext import commands
 import discord
 
@@ -9,10 +12,32 @@ from .models import (Fighter, FakeFighter,
                      MODES, inject_help_modes,
                      SmashError,
                      FighterMenu, FighterPageSource)
-from utils import commaize, clamp
+from .scheduler import InactivityScheduler
+from .journal import Journal
+from .history import History
+from .registry import MemoryRegistry, SQLiteRegistry
+from .reactions import ReactionRouter
+from .deleter import DeleteQueue
+from .outbox import Outbox, Priority
+from utils import commaize, clamp, pluralize
+import config
 
 
 _NAME, *_ALIASES = MODES.keys()
+RANDOM = ('', 'rand', 'random')
+
+
+def split_names(arg):
+    """Split a comma-separated list of fighter names, dropping empty names."""
+    return [name for name in (n.strip() for n in arg.split(',')) if name]
+
+
+def minutes(seconds):
+    return pluralize('minute', 'minutes', seconds / 60, '{n:g} {s}')
+
+
+def percent(part, whole):
+    return f'{part / whole:.0%}' if whole else '0%'
 
 
 def game_in_progress(*, player_active=True):
@@ -30,9 +55,203 @@ class Smash(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.players = {}  # {member: Player}
+        self.inactivity = InactivityScheduler(bot.loop, self._on_inactive, config.smash_inactivity_timeout)
+        self.inactivity.start()
+        handoff = bot.handoffs.pop('smash', None)  # from the previous instance, when reloaded
+        self.reactions = ReactionRouter()
+        if handoff is not None:
+            self.reactions.take_over(handoff['reactions'])
+        self.outbox = Outbox(bot.loop, bot.metrics)
+        self.deleter = DeleteQueue(bot, self.outbox, config.smash_delete_delay)
+        self.history = History(config.smash_history, bot.loop) if config.smash_history else None
+        if config.smash_registry:
+            self.registry = SQLiteRegistry(config.smash_registry, bot.worker_name or 'main', bot.loop)
+        else:
+            self.registry = MemoryRegistry()
+        self.journal = None
+        self._restoring = []  # games rebuilt from the journal, waiting for their members and message
+        if config.smash_journal:
+            self.journal = Journal(bot.worker_path(config.smash_journal), self._dump_games)
+            if handoff is None:
+                self._load_journal()
+            else:
+                self._restoring = [Game.from_dict(self, data, edit_window=config.smash_edit_window)
+                                   for data in handoff['restoring']]
+            self.journal.open()
+            self._restore_task = bot.loop.create_task(self._restore())
         self.short_commands = short = (self.pick, self.ban, self.unban, self.win, self.undo, self.change)
+        self.short_names = {name: cmd for cmd in short for name in (cmd.name, *cmd.aliases)}
         self.delete_commands = (*short, *self.change.commands,
-                                self.end, self.repost, self.add, self.leave, self.rejoin)
+                                self.end, self.repost, self.add, self.leave, self.rejoin, self.remaining)
+        self.smash_errors = bot.metrics.counter('smash_errors', 'Smash commands rejected with a SmashError.',
+                                                ('command',))
+        bot.metrics.gauge('smash_games', 'Smash games in progress.', func=lambda: len(self.games))
+        bot.metrics.gauge('smash_players', 'Players in smash games.', func=lambda: len(self.players))
+        self._reclaim_task = None
+        if handoff is not None:
+            self._resume(handoff['games'])
+
+    def cog_unload(self):
+        self.bot.metrics.gauge('smash_games', 'Smash games in progress.')
+        self.bot.metrics.gauge('smash_players', 'Players in smash games.')
+        self.inactivity.stop()
+        if self._reclaim_task is not None:
+            self._reclaim_task.cancel()
+        self.bot.handoffs['smash'] = self._handoff()
+        self.deleter.close()
+        self.outbox.close()
+        if self.history is not None:
+            self.history.close()
+        self.registry.close()
+        if self.journal is not None:
+            self._restore_task.cancel()
+            self.journal.snapshot()
+            self.journal.close()
+
+    def _handoff(self):
+        """Stop every game's timers and collect what the next instance needs to carry them on."""
+        games = []
+        for game in self.games:
+            if game._ending or game.message is None:
+                continue
+            state = game.handoff()
+            state['last_active'] = self.inactivity.last_active(game)
+            games.append(state)
+            for member in game.players:
+                self.bot.member_cache.release(member)
+        return {'games': games, 'restoring': [g.to_dict() for g in self._restoring], 'reactions': self.reactions}
+
+    def _resume(self, games):
+        """Carry on the games handed off by the previous instance, without any requests to Discord."""
+        resumed = []
+        for state in games:
+            try:
+                game = Game.resume(self, state, edit_window=config.smash_edit_window)
+            except Exception:
+                logging.exception(f'Failed to resume game {state["data"]["id"]}.')
+                continue
+            resumed.append(game)
+            self._start(game, game.channel.guild, last_active=state['last_active'])
+            if not game.is_shown():
+                # not a reply to whichever command reloaded the cog
+                contextvars.Context().run(self.bot.loop.create_task, game.update())
+        if self.journal is not None:
+            self.journal.snapshot()  # the new journal starts from these games
+        self._reclaim_task = self.bot.loop.create_task(self._reclaim(resumed))
+
+    async def _reclaim(self, games):
+        """Claim the members of resumed games again, as the registry is new as well."""
+        for game in games:
+            taken = await self.registry.claim(game.id, [m.id for m in game.players])
+            if taken:
+                logging.warning(f'Members {taken} of resumed game {game.id} are also in another game.')
+
+    def notify(self, channel, content, *, delete_after=5):
+        """Send a notice that deletes itself, behind the channel's more important requests.
+
+        A notice identical to one still waiting is sent once, and one that waited longer than it
+        would have been shown for is not sent at all.
+        """
+        content = str(content)
+        return self.outbox.submit(channel.id, Priority.NOTICE,
+                                  functools.partial(self._send_notice, channel, content, delete_after),
+                                  key=('notice', content), max_age=delete_after)
+
+    async def _send_notice(self, channel, content, delete_after):
+        message = await channel.send(content)
+        self.deleter.add(message, after=delete_after)
+        return message
+
+    @property
+    def games(self):
+        return {p.game for p in self.players.values()}
+
+    def _dump_games(self):
+        games = self.games
+        games.update(self._restoring)
+        # ending games are only still here until their result is sent, and their 'end' is already journaled
+        return [g.to_dict() for g in games if not g._ending]
+
+    def _load_journal(self):
+        games, events = self.journal.load()
+        restored = {}
+        for data in games:
+            restored[data['id']] = Game.from_dict(self, data, edit_window=config.smash_edit_window)
+        for game_id, op, args in events:
+            if op == 'new':
+                restored[game_id] = Game.from_dict(self, args[0], edit_window=config.smash_edit_window)
+            elif op == 'end':
+                restored.pop(game_id, None)
+            elif game_id in restored:
+                try:
+                    restored[game_id].apply(op, *args)
+                except Exception:
+                    logging.exception(f'Failed to replay {op} {args} on game {game_id}, dropping it.')
+                    del restored[game_id]
+        self._restoring = list(restored.values())
+
+    async def _restore(self):
+        """Re-attach journaled games to their members and board once the bot is ready."""
+        await self.bot.wait_until_ready()
+        for game in self._restoring:
+            try:
+                restored = await self._attach(game)
+            except Exception:
+                logging.exception(f'Failed to restore game {game.id}.')
+                restored = False
+            if not restored:
+                logging.warning(f'Dropped game {game.id} from the journal.')
+        self._restoring = []
+        self.journal.snapshot()
+
+    async def _attach(self, game):
+        if game._message_ref is None:
+            return False
+        channel_id, message_id = game._message_ref
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            return False
+        guild = channel.guild
+        members = {}
+        for player in game.players.values():
+            member_id = player.member.id
+            member = guild.get_member(member_id)
+            if member is None:
+                try:
+                    member = await guild.fetch_member(member_id)
+                except discord.NotFound:
+                    member = self.bot.get_user(member_id) or await self.bot.fetch_user(member_id)
+            if member in self.players:
+                return False
+            members[member_id] = member
+        if await self.registry.claim(game.id, members):
+            self.registry.release(game.id)
+            return False
+        archive = []
+        for archive_channel_id, archive_id in game._archive_refs:
+            archive_channel = self.bot.get_channel(archive_channel_id)
+            if archive_channel is not None:
+                archive.append(archive_channel.get_partial_message(archive_id))
+        game.attach(channel.get_partial_message(message_id), members, archive)
+        self._start(game, guild)
+        return True
+
+    def _start(self, game, guild, *, last_active=None):
+        """Register a new, restored or resumed game with the cog."""
+        game.journal = self.journal
+        self.players.update(game.players)
+        for member in game.players:
+            self.bot.member_cache.keep(member)
+        self.inactivity.add(game, self.bot.settings.get(guild.id, 'smash_inactivity_timeout'),
+                            last_active=last_active)
+
+    @property
+    def pending_games(self):
+        """Number of games waiting on the inactivity scheduler."""
+        return len(self.inactivity)
+
+    def _on_inactive(self, game):
+        game._prompt = self.bot.loop.create_task(game.check_activity())
 
     @commands.command()
     async def fighters(self, ctx):
@@ -41,54 +260,158 @@ class Smash(commands.Cog):
         if ctx.author in self.players:
             users = self.players[ctx.author].game.players
 
-        source = FighterPageSource(list(Fighter.all()), per_page=20)
-        menu = FighterMenu(source, timeout=300, delete_message_after=True)
+        source = FighterPageSource(per_page=20)
+        menu = FighterMenu(source, router=self.reactions, timeout=300, delete_message_after=True)
         await menu.start(ctx, users=users)
 
+    @commands.group(invoke_without_command=True)
+    async def stats(self, ctx, *, member: discord.Member = None):
+        """Show a player's match history statistics."""
+        if self.history is None:
+            return
+        member = member or ctx.author
+        totals, fighters = await self.history.user(member.id)
+        if totals is None:
+            await ctx.send(f'{member.display_name} has not finished any games.')
+            return
+        embed = discord.Embed(title=f'Stats for {member.display_name}')
+        embed.add_field(name='Games', value=f'{totals["game_wins"]}/{totals["games"]} won '
+                                            f'({percent(totals["game_wins"], totals["games"])})')
+        embed.add_field(name='Rounds', value=f'{totals["round_wins"]}/{totals["rounds"]} won '
+                                             f'({percent(totals["round_wins"], totals["rounds"])})')
+        embed.add_field(name='Bans', value=str(totals['bans']))
+        if fighters:
+            embed.add_field(name='Most Picked', inline=False, value='\n'.join(
+                f'{f["fighter"]}: {f["wins"]}/{f["picks"]} won ({percent(f["wins"], f["picks"])})' for f in fighters))
+        await ctx.send(embed=embed)
+
+    @stats.command(name='fighter')
+    async def stats_fighter(self, ctx, *, fighter: Fighter):
+        """Show how often a fighter is picked, wins and is banned."""
+        if self.history is None:
+            return
+        totals = await self.history.fighter(fighter.name)
+        if totals is None:
+            await ctx.send(f'{fighter} has not been played or banned.')
+            return
+        embed = discord.Embed(title=f'Stats for {fighter}', color=fighter.color)
+        embed.add_field(name='Picks', value=str(totals['picks']))
+        embed.add_field(name='Wins', value=f'{totals["wins"]} ({percent(totals["wins"], totals["picks"])})')
+        embed.add_field(name='Bans', value=str(totals['bans']))
+        await ctx.send(embed=embed)
+
+    @stats.command(name='vs')
+    async def stats_vs(self, ctx, member: discord.Member, opponent: discord.Member = None):
+        """Show the head-to-head game record between you, or another member, and an opponent."""
+        if self.history is None:
+            return
+        if opponent is None:
+            member, opponent = ctx.author, member
+        record = await self.history.head_to_head(member.id, opponent.id)
+        if record is None:
+            await ctx.send(f'{member.display_name} and {opponent.display_name} have not finished a game together.')
+            return
+        losses = await self.history.head_to_head(opponent.id, member.id)
+        await ctx.send(f'{member.display_name} vs {opponent.display_name}: {record["games"]} games, '
+                       f'{record["wins"]} won by {member.display_name}, '
+                       f'{losses["wins"]} won by {opponent.display_name}.')
+
     @commands.command(aliases=['p'])
     @game_in_progress()
-    async def pick(self, ctx, round_num: typing.Optional[int] = None, *, fighter=''):
-        """Pick a fighter to play in a given round."""
+    async def pick(self, ctx, round_num: typing.Optional[int] = None, *, fighters=''):
+        """Pick fighters to play, separated by commas, starting in a given round."""
         player = ctx.player
         game = player.game
-        if fighter in ('', 'rand', 'random'):
-            fighter = random.choice([f for f in Fighter.all() if game.mode.pick_check(player, f)])
-        elif fighter in FakeFighter.names:
-            fighter = FakeFighter(fighter)
-        else:
-            fighter = Fighter.get_closest(fighter)
-            allowed = game.mode.pick_check(player, fighter)
-            if not allowed:
-                raise SmashError(allowed)
-        if round_num is not None:
-            player.play(fighter, round_num - 1)
-        else:
-            player.play(fighter)
+        names = split_names(fighters) or ['']
+        named = iter(Fighter.get_many((n for n in names if n not in RANDOM), fake=True))
+        picks = []
+        pending = 0
+        for name in names:
+            if name in RANDOM:
+                allowed = game.mode.pick_mask(player, pending)
+                if not allowed:
+                    raise SmashError('There are no fighters left to pick.')
+                fighter = Fighter.random(allowed)
+            else:
+                fighter = next(named)
+                if not isinstance(fighter, FakeFighter):
+                    allowed = game.mode.pick_check(player, fighter, pending)
+                    if not allowed:
+                        raise SmashError(allowed)
+            pending |= fighter.bit
+            picks.append(fighter)
+        for fighter in picks:
+            if round_num is not None:
+                player.play(fighter, round_num - 1)
+                round_num += 1
+            else:
+                player.play(fighter)
         await game.update()
 
+    @commands.command(aliases=['left'])
+    @game_in_progress()
+    async def remaining(self, ctx):
+        """List the fighters each player may still pick in the current mode."""
+        game = ctx.player.game
+        embed = discord.Embed(title=f'Remaining Fighters - {game.mode.name}')
+        size = len(embed.title)
+        for member, player in game.players.items():
+            if not player.active:
+                continue
+            allowed = game.mode.pick_mask(player)
+            names = [f.name for f in Fighter.from_mask(allowed)]
+            excluded = [f.name for f in Fighter.from_mask(Fighter.all_mask & ~allowed)]
+            if not excluded:
+                value = 'Any fighter'
+            elif not names:
+                value = 'None'
+            elif len(excluded) < len(names):
+                value = f'Any except {", ".join(excluded)}'
+            else:
+                value = ', '.join(names)
+            if len(value) > 1024 or size + len(value) > 5000:
+                value = f'{len(names)} fighters'
+            name = f'{member.display_name} ({len(names)})'
+            size += len(name) + len(value)
+            embed.add_field(name=name, value=value, inline=False)
+        await ctx.send(embed=embed, delete_after=60)
+
     @commands.command(aliases=['b'])
     @game_in_progress()
-    async def ban(self, ctx, *, fighter: Fighter):
-        """Ban a fighter for everyone playing."""
+    async def ban(self, ctx, *, fighters):
+        """Ban fighters, separated by commas, for everyone playing."""
         player = ctx.player
         game = player.game
-        allowed = game.mode.ban_check(player, fighter)
-        if not allowed:
-            raise SmashError(allowed)
-        player.ban(fighter)
+        fighters = Fighter.get_many(split_names(fighters))
+        if not fighters:
+            return
+        if game.max_bans and len(fighters) > game.max_bans:
+            raise SmashError(f'You may only ban {game.max_bans} fighters.')
+        pending = 0
+        for fighter in fighters:
+            allowed = game.mode.ban_check(player, fighter, pending)
+            if not allowed:
+                raise SmashError(allowed)
+            pending |= fighter.bit
+        for fighter in fighters:
+            player.ban(fighter)
         await game.update()
 
     @commands.command(aliases=['ub'])
     @game_in_progress()
-    async def unban(self, ctx, *, fighter: Fighter):
-        """Unban a fighter you have banned.
+    async def unban(self, ctx, *, fighters):
+        """Unban fighters you have banned, separated by commas.
 
         Note: This is not necessary with a ban limit, as the oldest will automatically be removed when banning another."""
         player = ctx.player
-        if player.has_banned(fighter):
+        fighters = dict.fromkeys(Fighter.get_many(split_names(fighters)))  # dedupe, keeping order
+        if not fighters:
+            return
+        not_banned = [f.name for f in fighters if not player.has_banned(f)]
+        if not_banned:
+            raise SmashError(f'You have not banned {commaize(not_banned)}.')
+        for fighter in fighters:
             player.unban(fighter)
-        else:
-            raise SmashError(f'You have not banned {fighter}.')
         await player.game.update()
 
     @commands.command(aliases=['w'])
@@ -184,7 +507,7 @@ class Smash(commands.Cog):
         """Vote to end the game. Requires majority vote to succeed."""
         game = ctx.player.game
         ctx.player.vote_to_end()
-        if sum(p.end for p in game.players.values() if p.active) >= game.votes_to_end:
+        if game.end_votes >= game.votes_to_end:
             await game.end(reason=EndReason.vote)
         else:
             await game.update()
@@ -204,6 +527,7 @@ class Smash(commands.Cog):
         w            "win" | mark the latest round as a win
         w 2                | mark round 2 as a win
         p name      "pick" | pick a fighter
+        p name, name       | pick fighters for the next rounds
         p 2 name           | pick a fighter and insert at round 2
         p -                | pick nothing (skip round)
         p ???              | pick unknown character (if character is not yet added to bot)
@@ -213,7 +537,9 @@ class Smash(commands.Cog):
         u 2                | undo round 2, removing fighter + win
         u 2 w              | undo round 2's win, leaving the fighter
         b name       "ban" | ban a fighter
+        b name, name       | ban several fighters
         ub name    "unban" | unban a fighter
+        ub name, name      | unban several fighters
         c w 3     "change" | change winning score to 3
         c m elimination    | change gamemode to elimination
         c b 2              | change allowed number of bans to 2
@@ -221,6 +547,7 @@ class Smash(commands.Cog):
         c a                | remove arena id
         ,repost #channel   | repost the board to another channel
         ,repost            | repost the board
+        ,remaining         | list fighters each player may still pick
         ,end               | vote to end the match. requires majority
         ,add @User @User2  | add users to the game. this will also insert blank rounds for them.
         ,leave             | leave the game
@@ -235,22 +562,95 @@ class Smash(commands.Cog):
         elif count > 25:
             await ctx.send('Too many players to start a game. Limit of 25 players.')
             return
+        defaults = self.bot.settings.guild(ctx.guild.id)
         if winning_score is None:
-            winning_score = 0
+            winning_score = defaults.get('smash_winning_score', 0)
         else:
             winning_score = clamp(winning_score, low=0)
+        if max_bans is None:
+            max_bans = defaults.get('smash_max_bans')
         already_in_game = [p for p in players if p in self.players]
+        if not already_in_game:
+            taken = await self.registry.claim(ctx.message.id, [p.id for p in players])
+            already_in_game = [p for p in players if p.id in taken]
+            if already_in_game:
+                self.registry.release(ctx.message.id)
         if already_in_game:
             if len(already_in_game) == 1:
-                await ctx.send(f'{already_in_game[0].mention} is already in a game.', delete_after=5)
+                self.notify(ctx.channel, f'{already_in_game[0].mention} is already in a game.')
             else:
-                await ctx.send(f'{commaize(m.mention for m in already_in_game)} are already in a game.', delete_after=5)
+                self.notify(ctx.channel, f'{commaize(m.mention for m in already_in_game)} are already in a game.')
             return
-        mode = MODES[ctx.invoked_with]
-        game = Game(ctx, arena_id, mode, players, winning_score, max_bans, ctx.message.created_at)
-        self.players.update(game.players)
+        if ctx.invoked_with == _NAME:
+            mode = MODES[defaults.get('smash_mode', _NAME)]
+        else:
+            mode = MODES[ctx.invoked_with]
+        game = Game(self, ctx.message.id, arena_id, mode, players, winning_score, max_bans, ctx.message.created_at,
+                    edit_window=config.smash_edit_window)
+        self._start(game, ctx.guild)
+        game.record('new', game.to_dict())
         await game.update(destination=ctx)
 
+    @commands.group(invoke_without_command=True)
+    async def defaults(self, ctx):
+        """Show this server's settings for new games."""
+        defaults = self.bot.settings.guild(ctx.guild.id)
+        mode = MODES[defaults.get('smash_mode', _NAME)]
+        winning_score = defaults.get('smash_winning_score', 0)
+        max_bans = defaults.get('smash_max_bans')
+        timeout = defaults.get('smash_inactivity_timeout', config.smash_inactivity_timeout)
+        embed = discord.Embed(title='Game Defaults')
+        embed.add_field(name='Mode', value=f'{mode.name}\n(when started with "{_NAME}")')
+        embed.add_field(name='Wins', value=str(winning_score or 'Unlimited'))
+        embed.add_field(name='Bans', value='Unlimited' if max_bans is None else str(max_bans))
+        embed.add_field(name='Inactivity', value=minutes(timeout))
+        await ctx.send(embed=embed)
+
+    @defaults.command(name='mode', aliases=['m', 'gamemode'])
+    @commands.has_guild_permissions(manage_guild=True)
+    async def defaults_mode(self, ctx, mode):
+        """Change the mode of games started with the main command."""
+        mode = mode.lower()
+        if mode not in MODES:
+            await ctx.send(f'{mode} is not a valid mode.')
+            return
+        self.bot.settings.set(ctx.guild.id, 'smash_mode', None if mode == _NAME else mode)
+        await ctx.send(f'New games will be {MODES[mode].name}.')
+
+    @defaults.command(name='wins', aliases=['w', 'win'])
+    @commands.has_guild_permissions(manage_guild=True)
+    async def defaults_wins(self, ctx, number: int):
+        """Change the number of wins new games end at, 0 for unlimited."""
+        number = clamp(number, low=0)
+        self.bot.settings.set(ctx.guild.id, 'smash_winning_score', number or None)
+        await ctx.send(f'New games will end at {number} wins.' if number else 'New games will not end at a score.')
+
+    @defaults.command(name='bans', aliases=['b', 'maxbans'])
+    @commands.has_guild_permissions(manage_guild=True)
+    async def defaults_bans(self, ctx, number: int = None):
+        """Change the number of bans allowed in new games, or leave it out for unlimited."""
+        if number is not None:
+            number = clamp(number, low=0)
+        self.bot.settings.set(ctx.guild.id, 'smash_max_bans', number)
+        await ctx.send('New games will allow unlimited bans.' if number is None else
+                       f'New games will allow {pluralize("ban", "bans", number)}.')
+
+    @defaults.command(name='inactivity', aliases=['i', 'timeout'])
+    @commands.has_guild_permissions(manage_guild=True)
+    async def defaults_inactivity(self, ctx, length: float):
+        """Change how many minutes new games wait without activity before asking if they're still being played."""
+        seconds = clamp(round(length * 60), low=60, high=24 * 60 * 60)
+        self.bot.settings.set(ctx.guild.id, 'smash_inactivity_timeout',
+                              None if seconds == config.smash_inactivity_timeout else seconds)
+        await ctx.send(f'New games will ask after {minutes(seconds)}.')
+
+    @defaults.command(name='reset')
+    @commands.has_guild_permissions(manage_guild=True)
+    async def defaults_reset(self, ctx):
+        """Reset every game default."""
+        self.bot.settings.reset(ctx.guild.id, 'smash_')
+        await ctx.send('Game defaults have been reset.')
+
     @commands.command()
     @game_in_progress()
     async def add(self, ctx, *new_players: discord.Member):
@@ -267,15 +667,21 @@ class Smash(commands.Cog):
                 already_in_game.append(m)
             else:
                 game.players[m].active = True
+        if to_add:
+            taken = await self.registry.claim(game.id, [m.id for m in to_add])
+            already_in_game.extend(m for m in to_add if m.id in taken)
+            to_add = [m for m in to_add if m.id not in taken]
         if already_in_game:
             if len(already_in_game) == 1:
-                await ctx.send(f'{already_in_game[0].mention} is already in a game.', delete_after=5)
+                self.notify(ctx.channel, f'{already_in_game[0].mention} is already in a game.')
             else:
-                await ctx.send(f'{commaize(m.mention for m in already_in_game)} are already in a game.', delete_after=5)
+                self.notify(ctx.channel, f'{commaize(m.mention for m in already_in_game)} are already in a game.')
         if not to_add:
             return
         players = game.add_players(*to_add)
         self.players.update(players)
+        for member in players:
+            self.bot.member_cache.keep(member)
         round_num = player.current_round - 1
         if round_num >= 0:
             for p in players.values():
@@ -299,37 +705,55 @@ class Smash(commands.Cog):
         ctx.player.active = True
         await ctx.player.game.update()
 
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload):
+        self.reactions.dispatch(payload)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_remove(self, payload):
+        self.reactions.dispatch(payload)
+
     @commands.Cog.listener()
     async def on_message(self, msg):
-        if not msg.content:
+        player = self.players.get(msg.author)
+        if player is None or player.game.channel != msg.channel or not msg.content:
             return
-        ctx = await self.bot.get_context(msg)
-        if ctx.valid:
+        view = StringView(msg.content)
+        invoked_with = view.get_word()
+        cmd = self.short_names.get(invoked_with.lower())
+        if cmd is None:
             return
-        cmd = self.bot.get_command(ctx.view.get_word().lower())
         prefix = await self.bot.get_prefix(msg)
         if isinstance(prefix, list):
-            ctx.prefix = prefix[-1]
-        else:
-            ctx.prefix = prefix
-        if cmd is None or cmd.cog is not self or cmd not in self.short_commands:
-            return
-        try:
-            await cmd.invoke(ctx)
-        except commands.CommandInvokeError as e:
-            self.bot.dispatch('command_error', ctx, e)
-            await msg.channel.send(e.original, delete_after=5)
-        except (commands.ConversionError, commands.UserInputError, SmashError) as e:
-            e = getattr(e, 'original', e)
-            await msg.channel.send(e, delete_after=5)
-        except commands.CommandError:  # don't care about check error/command not found
-            pass
-        except Exception as e:
-            self.bot.dispatch('command_error', ctx, commands.CommandInvokeError(e))
+            prefix = prefix[-1]
+        ctx = commands.Context(prefix=prefix, view=view, bot=self.bot, message=msg, invoked_with=invoked_with)
+        with self.bot.metrics.invocation(cmd.qualified_name, 'short'):
+            try:
+                await cmd.invoke(ctx)
+            except commands.CommandInvokeError as e:
+                self._count_error(cmd, e)
+                self.bot.dispatch('command_error', ctx, e)
+                self.notify(msg.channel, e.original)
+            except (commands.ConversionError, commands.UserInputError, SmashError) as e:
+                self._count_error(cmd, e)
+                self.bot.metrics.error(cmd.qualified_name, e)
+                e = getattr(e, 'original', e)
+                self.notify(msg.channel, e)
+            except commands.CommandError:  # don't care about check error/command not found
+                pass
+            except Exception as e:
+                self.bot.dispatch('command_error', ctx, commands.CommandInvokeError(e))
+
+    def _count_error(self, command, exc):
+        if isinstance(getattr(exc, 'original', exc), SmashError):
+            self.smash_errors.inc(command=command.qualified_name)
+
+    async def cog_command_error(self, ctx, error):
+        self._count_error(ctx.command, error)
 
     async def cog_check(self, ctx):
         return ctx.guild
 
     async def cog_before_invoke(self, ctx):
         if ctx.command in self.delete_commands:
-            await ctx.message.delete(delay=1)
+            self.deleter.add(ctx.message)
@@ -0,0 +1,92 @@
+import contextvars
+import functools
+import logging
+
+import discord
+
+from .outbox import Priority
+
+
+class DeleteQueue:
+    """Deletes messages in batches per channel instead of one request each.
+
+    Messages are collected for `delay` seconds after the first in a channel, then deleted through
+    the outbox as cleanup, after the channel's more important requests, with one bulk delete
+    (or a single delete for one message).
+    """
+    def __init__(self, bot, outbox, delay=1):
+        self.bot = bot
+        self.outbox = outbox
+        self.delay = delay
+        self._pending = {}  # {channel ID: {message ID: message}}
+        self._timers = {}  # {channel ID: timer handle}
+        self._closed = False
+
+    def __len__(self):
+        return sum(len(m) for m in self._pending.values())
+
+    def add(self, message, *, after=0):
+        """Queue `message` to be deleted, after waiting `after` seconds if given."""
+        if after:
+            self._call_later(after, self.add, message)
+            return
+        if self._closed:
+            self.bot.loop.create_task(self._delete(message.channel, [message]))
+            return
+        channel_id = message.channel.id
+        self._pending.setdefault(channel_id, {})[message.id] = message
+        if channel_id not in self._timers:
+            self._timers[channel_id] = self._call_later(self.delay, self._submit, message.channel)
+
+    def _call_later(self, delay, callback, *args):
+        # deleting isn't part of whichever command queued it
+        return self.bot.loop.call_later(delay, callback, *args, context=contextvars.Context())
+
+    def close(self):
+        """Delete everything still queued right away, and anything added later without batching."""
+        self._closed = True
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for messages in self._pending.values():
+            channel = next(iter(messages.values())).channel
+            self.bot.loop.create_task(self._delete(channel, list(messages.values())))
+        self._pending.clear()
+
+    def _submit(self, channel):
+        del self._timers[channel.id]
+        self.outbox.submit(channel.id, Priority.CLEANUP, functools.partial(self._flush, channel), key='delete')
+
+    async def _flush(self, channel):
+        messages = self._pending.pop(channel.id, None)
+        if messages:
+            await self._delete(channel, list(messages.values()))
+
+    async def _delete(self, channel, messages):
+        for start in range(0, len(messages), 100):
+            batch = messages[start:start + 100]
+            try:
+                await channel.delete_messages(batch)
+            except discord.HTTPException as e:
+                # bulk deletes need Manage Messages even for the bot's own messages, and fail on old ones
+                await self._delete_each(channel, batch, forbidden=isinstance(e, discord.Forbidden))
+
+    async def _delete_each(self, channel, messages, *, forbidden):
+        """Delete `messages` one at a time, skipping other authors' if the bot may not delete them."""
+        me = self.bot.user
+        skipped = 0
+        for message in messages:
+            # partial messages are only made for the bot's own boards
+            if forbidden and getattr(message, 'author', me) != me:
+                skipped += 1
+                continue
+            try:
+                await message.delete()
+            except discord.NotFound:
+                pass
+            except discord.Forbidden:
+                skipped += 1
+            except discord.HTTPException:
+                logging.warning(f'Failed to delete message {message.id} in channel {channel.id}.', exc_info=True)
+        if skipped:
+            logging.info(f'Missing permission to delete {skipped} messages in channel {channel.id}.')
@@ -0,0 +1,183 @@
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import logging
+import sqlite3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    guild_id INTEGER,
+    channel_id INTEGER,
+    mode TEXT,
+    winning_score INTEGER,
+    max_bans INTEGER,
+    started_at TEXT,
+    ended_at TEXT,
+    duration REAL,
+    end_reason TEXT,
+    winner_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS game_players (
+    game_id INTEGER,
+    user_id INTEGER,
+    wins INTEGER,
+    PRIMARY KEY (game_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS rounds (
+    game_id INTEGER,
+    user_id INTEGER,
+    round INTEGER,
+    fighter TEXT,
+    win INTEGER
+);
+CREATE TABLE IF NOT EXISTS bans (
+    game_id INTEGER,
+    user_id INTEGER,
+    fighter TEXT
+);
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INTEGER PRIMARY KEY,
+    games INTEGER NOT NULL DEFAULT 0,
+    game_wins INTEGER NOT NULL DEFAULT 0,
+    rounds INTEGER NOT NULL DEFAULT 0,
+    round_wins INTEGER NOT NULL DEFAULT 0,
+    bans INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS fighter_stats (
+    fighter TEXT PRIMARY KEY,
+    picks INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    bans INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS user_fighter_stats (
+    user_id INTEGER,
+    fighter TEXT,
+    picks INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, fighter)
+);
+CREATE TABLE IF NOT EXISTS head_to_head (
+    user_id INTEGER,
+    opponent_id INTEGER,
+    games INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, opponent_id)
+);
+'''
+
+
+class History:
+    """SQLite store of finished games.
+
+    Raw games, rounds and bans are kept for reference, but every query reads aggregate
+    tables that are updated in the same transaction as each game is inserted.
+    All database access happens on a single worker thread.
+    """
+    def __init__(self, path, loop):
+        self.path = path
+        self.loop = loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='smash-history')
+        self._conn = None
+        self._executor.submit(self._connect)
+
+    def _connect(self):
+        self._conn = conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+
+    def _run(self, func, *args):
+        return self.loop.run_in_executor(self._executor, func, *args)
+
+    def close(self):
+        self._executor.submit(self._close)
+        self._executor.shutdown(wait=False)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def add(self, game):
+        """Schedule a finished game, as returned by `Game.summary`, to be saved."""
+        future = self._run(self._add, game)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    @staticmethod
+    def _log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            exc = future.exception()
+            logging.error('Failed to save finished game.', exc_info=(type(exc), exc, exc.__traceback__))
+
+    def _add(self, game):
+        players = game['players']
+        winner = game['winner_id']
+        with self._conn as conn:
+            inserted = conn.execute('INSERT OR IGNORE INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                    (game['id'], game['guild_id'], game['channel_id'], game['mode'],
+                                     game['winning_score'], game['max_bans'], game['started_at'], game['ended_at'],
+                                     game['duration'], game['end_reason'], winner)).rowcount
+            if not inserted:  # already saved, don't count it twice
+                return
+            for player in players:
+                user = player['user_id']
+                rounds = [r for r in player['rounds'] if r[2]]
+                conn.execute('INSERT OR IGNORE INTO game_players VALUES (?, ?, ?)', (game['id'], user, player['wins']))
+                conn.executemany('INSERT INTO rounds VALUES (?, ?, ?, ?, ?)',
+                                 ((game['id'], user, num, fighter, win) for num, (fighter, win, _) in
+                                  enumerate(player['rounds'], 1)))
+                conn.executemany('INSERT INTO bans VALUES (?, ?, ?)',
+                                 ((game['id'], user, fighter) for fighter in player['bans']))
+                conn.execute('''
+                    INSERT INTO user_stats VALUES (?, 1, ?, ?, ?, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        games = games + 1,
+                        game_wins = game_wins + excluded.game_wins,
+                        rounds = rounds + excluded.rounds,
+                        round_wins = round_wins + excluded.round_wins,
+                        bans = bans + excluded.bans''',
+                             (user, user == winner, len(rounds), sum(r[1] for r in rounds), len(player['bans'])))
+                conn.executemany('''
+                    INSERT INTO user_fighter_stats VALUES (?, ?, 1, ?)
+                    ON CONFLICT (user_id, fighter) DO UPDATE SET
+                        picks = picks + 1,
+                        wins = wins + excluded.wins''',
+                                 ((user, fighter, win) for fighter, win, _ in rounds))
+                conn.executemany('''
+                    INSERT INTO fighter_stats VALUES (?, 1, ?, 0)
+                    ON CONFLICT (fighter) DO UPDATE SET
+                        picks = picks + 1,
+                        wins = wins + excluded.wins''',
+                                 ((fighter, win) for fighter, win, _ in rounds))
+                conn.executemany('''
+                    INSERT INTO fighter_stats VALUES (?, 0, 0, 1)
+                    ON CONFLICT (fighter) DO UPDATE SET bans = bans + 1''',
+                                 ((fighter,) for fighter in player['bans']))
+            conn.executemany('''
+                INSERT INTO head_to_head VALUES (?, ?, 1, ?)
+                ON CONFLICT (user_id, opponent_id) DO UPDATE SET
+                    games = games + 1,
+                    wins = wins + excluded.wins''',
+                             ((a['user_id'], b['user_id'], a['user_id'] == winner)
+                              for a, b in itertools.permutations(players, 2)))
+
+    def _fetch(self, query, *args):
+        return self._conn.execute(query, args).fetchall()
+
+    async def user(self, user_id):
+        """Get a user's totals and most picked fighters."""
+        totals = await self._run(self._fetch, 'SELECT * FROM user_stats WHERE user_id = ?', user_id)
+        fighters = await self._run(self._fetch, '''
+            SELECT fighter, picks, wins FROM user_fighter_stats WHERE user_id = ?
+            ORDER BY picks DESC, wins DESC LIMIT 5''', user_id)
+        return (totals[0] if totals else None), fighters
+
+    async def fighter(self, name):
+        rows = await self._run(self._fetch, 'SELECT * FROM fighter_stats WHERE fighter = ?', name)
+        return rows[0] if rows else None
+
+    async def head_to_head(self, user_id, opponent_id):
+        rows = await self._run(self._fetch, 'SELECT * FROM head_to_head WHERE user_id = ? AND opponent_id = ?',
+                               user_id, opponent_id)
+        return rows[0] if rows else None
@@ -0,0 +1,117 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import json
+import os
+
+
+class Journal:
+    """Append-only log of game mutations with periodic snapshots.
+
+    Each journal line is a JSON array of `[seq, game_id, op, *args]`.
+    The snapshot holds every game's `Game.to_dict` as of its `seq`, so restoring only
+    replays journal lines after it. Taking a snapshot truncates the journal.
+    Lines and snapshots are encoded and written by a single worker thread, in the order they're made.
+    """
+    def __init__(self, path, dump, *, snapshot_every=1000):
+        self.path = path
+        self.snapshot_path = f'{path}.snapshot'
+        self.dump = dump  # callable returning a list of game dicts
+        self.snapshot_every = snapshot_every
+        self.seq = 0
+        self._since_snapshot = 0
+        self._file = None
+        self._open = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='smash-journal')
+
+    def load(self):
+        """Read the snapshot and journal, returning `(games, events)`.
+
+        `games` is a list of game dicts and `events` the `(game_id, op, args)` recorded after them.
+        """
+        games = []
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            pass
+        else:
+            self.seq = snapshot['seq']
+            games = snapshot['games']
+        events = []
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        seq, game_id, op, *args = json.loads(line)
+                    except ValueError:  # partially written line from a crash
+                        logging.warning(f'Skipping corrupt journal line: {line!r}')
+                        continue
+                    if seq <= self.seq:
+                        continue
+                    self.seq = seq
+                    events.append((game_id, op, args))
+        except FileNotFoundError:
+            pass
+        self._since_snapshot = len(events)
+        return games, events
+
+    def open(self):
+        if not self._open:
+            self._open = True
+            self._submit(self._open_file)
+
+    def close(self):
+        """Stop recording, waiting for everything already recorded to be written."""
+        if self._open:
+            self._open = False
+            self._submit(self._close_file)
+        self._executor.shutdown(wait=True)
+
+    def _submit(self, func, *args):
+        self._executor.submit(func, *args).add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            exc = future.exception()
+            logging.error('Failed writing smash journal.', exc_info=(type(exc), exc, exc.__traceback__))
+
+    def _open_file(self):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def record(self, game_id, op, *args):
+        if not self._open:
+            return
+        self.seq += 1
+        self._submit(self._append, [self.seq, game_id, op, *args])
+        self._since_snapshot += 1
+        if self._since_snapshot >= self.snapshot_every:
+            self.snapshot()
+
+    def _append(self, entry):
+        self._file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self._file.flush()
+
+    def snapshot(self):
+        """Write the state of every game and truncate the journal."""
+        # games are read now, so the snapshot matches `seq`, and encoded along with writing
+        self._submit(self._write_snapshot, self.seq, self.dump())
+        self._since_snapshot = 0
+
+    def _write_snapshot(self, seq, games):
+        tmp = f'{self.snapshot_path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'seq': seq, 'games': games}, f, separators=(',', ':'))
+        os.replace(tmp, self.snapshot_path)
+        reopen = self._file is not None
+        self._close_file()
+        with open(self.path, 'w'):
+            pass
+        if reopen:
+            self._open_file()
@@ -1,10 +1,10 @@
 from functools import lru_cache
+import random
 import re
 
-from discord.ext import commands
-
 from ..data import fighters as _fighters
 from .errors import SmashError
+from utils import commaize
 
 WORD = re.compile(r'\W+')
 
@@ -26,58 +26,158 @@ def find_ngrams(text: str, number: int = 3) -> set:
     return ngrams
 
 
-def compare_ngrams(ngrams1, ngrams2):
-    """https://stackoverflow.com/a/52389482
-    Finds the similarity between 2 ngrams.
-    ~~0 being completely different, and 1 being equal~~
+def split_number(number: str) -> list:
+    """Returns every lookup key for a fighter number.
 
-    Keeping above reference, though it has been modified.
-    Instead of 0-1, this function returns the number of similar ngrams.
+    Echo fighters also match with a plain `e` and ranges match each number in them.
     """
-    return len(ngrams1 & ngrams2)
-
-
-class Fighter(commands.Converter):
+    keys = [number]
+    if number.endswith('ᵋ'):
+        keys.append(number[:-1] + 'e')
+    elif '-' in number:
+        start, end = number.split('-')
+        keys.extend(str(n) for n in range(int(start), int(end) + 1))
+    return keys
+
+
+class Fighter:
+    """An immutable roster entry. Also usable as a command converter."""
+    __slots__ = ('index', 'bit', 'number', 'name', 'color', 'aliases', 'ngrams')
     __fighters = []
+    __ngram_index = {}  # {ngram: [Fighter]}
+    __numbers = {}  # {number: Fighter}
+    __names = {}  # {name: Fighter}
+    all_mask = 0  # bit of every fighter
+    by_index = []  # every fighter by index, fake fighters by their negative index from the end
     replace_on_insert = False
 
-    async def convert(self, ctx, arg):
-        return self.get_closest(arg)
+    def __init__(self, index, number, name, color, aliases):
+        init = super().__setattr__
+        init('index', index)
+        init('bit', 1 << index)
+        init('number', number)
+        init('name', name)
+        init('color', color)
+        init('aliases', tuple(aliases))
+        init('ngrams', frozenset(find_ngrams(name).union(*(find_ngrams(alias) for alias in aliases))))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    __delattr__ = __setattr__
+
+    @classmethod
+    async def convert(cls, ctx, arg):
+        return cls.get_closest(arg)
 
     @classmethod
     def add(cls, number, name, color, aliases=()):
-        self = cls()
-        self.number = number
-        self.name = name
-        self.color = color
-        self.aliases = aliases
-        self.__ngrams = frozenset(find_ngrams(name).union(*(find_ngrams(alias) for alias in aliases)))
+        self = cls(len(cls.__fighters), number, name, color, aliases)
         cls.__fighters.append(self)
+        cls.by_index = cls.__fighters + sorted(FakeFighter.all(), key=lambda f: f.index)
+        cls.__names[name] = self
+        cls.all_mask |= self.bit
+        for ngram in self.ngrams:
+            cls.__ngram_index.setdefault(ngram, []).append(self)
+        for num in split_number(number):
+            cls.__numbers[num] = self
+        cls._lookup.cache_clear()
 
     @classmethod
     def all(cls):
         return iter(cls.__fighters)
 
     @classmethod
-    @lru_cache()
+    def from_index(cls, index):
+        """Get a fighter by `index`, where fake fighters have negative indices."""
+        return cls.by_index[index]
+
+    @classmethod
+    def get(cls, name):
+        """Get a fighter, real or fake, by exact name, falling back to the closest match."""
+        if name in FakeFighter.names:
+            return FakeFighter(name)
+        try:
+            return cls.__names[name]
+        except KeyError:
+            return cls.get_closest(name)
+
+    @classmethod
+    def from_mask(cls, mask):
+        """Yield every fighter whose bit is set in `mask`, in roster order."""
+        fighters = cls.__fighters
+        while mask:
+            low = mask & -mask
+            yield fighters[low.bit_length() - 1]
+            mask ^= low
+
+    @classmethod
+    def random(cls, mask):
+        """Return a random fighter whose bit is set in `mask`."""
+        return random.choice(list(cls.from_mask(mask)))
+
+    @classmethod
+    def cache_info(cls):
+        return cls._lookup.cache_info()
+
+    @classmethod
     def get_closest(cls, name):
-        ngrams = find_ngrams(name)
-        similarities = {fighter: compare_ngrams(fighter.__ngrams, ngrams) for fighter in cls.all()}
-        sorted_sims = sorted(similarities.items(), key=lambda pair: (pair[1], len(pair[0].name)))
-        highest = max(pair[1] for pair in sorted_sims)
-        if highest == 0:
+        fighter = cls._lookup(' '.join(name.lower().split()))
+        if fighter is None:
             raise SmashError(f'{name} is not a valid fighter.')
+        return fighter
 
-        filtered = filter(lambda pair: pair[1] == highest, sorted_sims)
-        most_similar = next(filtered)
-        return most_similar[0]
+    @classmethod
+    def get_many(cls, names, *, fake=False):
+        """Get the closest fighter for each of `names` in order, including fake fighters if `fake` is set.
+
+        Every name is looked up before raising, so one error lists all invalid names.
+        """
+        fighters, invalid = [], []
+        for name in names:
+            if fake and name in FakeFighter.names:
+                fighters.append(FakeFighter(name))
+                continue
+            fighter = cls._lookup(' '.join(name.lower().split()))
+            if fighter is None:
+                invalid.append(name)
+            else:
+                fighters.append(fighter)
+        if len(invalid) == 1:
+            raise SmashError(f'{invalid[0]} is not a valid fighter.')
+        elif invalid:
+            raise SmashError(f'{commaize(invalid)} are not valid fighters.')
+        return fighters
+
+    @classmethod
+    @lru_cache(maxsize=1024)
+    def _lookup(cls, key):
+        """Find the fighter most similar to normalized `key`, or `None` if there is no match.
+
+        Misses are cached as `None` so repeated invalid names are not rescored.
+        """
+        try:
+            return cls.__numbers[key]
+        except KeyError:
+            pass
+        similarities = {}
+        for ngram in find_ngrams(key):
+            for fighter in cls.__ngram_index.get(ngram, ()):
+                similarities[fighter] = similarities.get(fighter, 0) + 1
+        if not similarities:
+            return None
+        return min(similarities, key=lambda f: (-similarities[f], len(f.name), f.index))
 
     def __str__(self):
         return self.name
 
+    def __repr__(self):
+        return f'<Fighter {self.number} {self.name}>'
+
 
 class _FakeFighter:
     ALLOWED = {'-': True, '???': False}
+    bit = 0
     __instances = {}  # hack to only ever have 1 + len(ALLOWED) instances
 
     @classmethod
@@ -87,8 +187,12 @@ class _FakeFighter:
             self.name = val
             self.color = 0xfffffe
             self.replace_on_insert = replace
+            self.index = -1 - len(cls.__instances)  # negative so they index `Fighter.by_index` from the end
             cls.__instances[val] = self
 
+    def all(self):
+        return self.__instances.values()
+
     @property
     def names(self):
         return self.__instances.keys()
@@ -0,0 +1,44 @@
+class FighterSet:
+    """Multiset of fighters with a bitmask of every fighter present at least once.
+
+    Fighters are identified by their `bit`, so fake fighters (bit 0) are never stored.
+    """
+    __slots__ = ('mask', '_counts')
+
+    def __init__(self):
+        self.mask = 0
+        self._counts = {}
+
+    def __contains__(self, fighter):
+        return bool(self.mask & fighter.bit)
+
+    def __len__(self):
+        return len(self._counts)
+
+    def count(self, fighter):
+        return self._counts.get(fighter.bit, 0)
+
+    def add(self, fighter):
+        """Add `fighter`, returning whether it was not already present."""
+        bit = fighter.bit
+        if not bit:
+            return False
+        count = self._counts.get(bit, 0)
+        self._counts[bit] = count + 1
+        if count:
+            return False
+        self.mask |= bit
+        return True
+
+    def remove(self, fighter):
+        """Remove one of `fighter`, returning whether it is no longer present."""
+        bit = fighter.bit
+        count = self._counts.get(bit, 0)
+        if not count:
+            return False
+        if count > 1:
+            self._counts[bit] = count - 1
+            return False
+        del self._counts[bit]
+        self.mask &= ~bit
+        return True
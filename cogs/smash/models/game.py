@@ -1,13 +1,23 @@
-from collections import deque
 from enum import Enum
+import functools
+import datetime
 import asyncio
+import logging
 import re
 
 import discord
 
+import metrics
+
+from .fighterset import FighterSet
+from .fighter import FakeFighter
 from .player import Player
+from .modes import MODES
+from ..outbox import Priority
 
 
+BOARD_SIZE = 5000  # characters each board embed is kept to, under Discord's limit of 6000
+FIELD_SIZE = 1024  # Discord's limit on a field value
 ARENA_ID = re.compile(r'^[0-9A-HJ-NP-Y]{5}$', flags=re.IGNORECASE)
 
 
@@ -24,55 +34,91 @@ class EndReason(Enum):
 
 
 class Game:
-    def __init__(self, ctx, arena_id, mode, members, winning_score, max_bans, created_at):
-        self.context = ctx
-        self.loop = ctx.bot.loop
+    __slots__ = ('cog', 'loop', 'id', 'journal', 'players', 'played', 'won', 'banned', 'created_at', 'message',
+                 'edit_window', '__arena_id', '__mode', '__winning_score', '__max_bans',
+                 '_active_count', '_end_votes', '_description', '_embed', '_embed_key', '_message_ref',
+                 '_archive', '_archive_refs', '_archive_sent', '_archive_ranges', '_archive_embeds', '_live_start',
+                 '_pending_edit', '_last_edit', '_waiting', '_last_embed', '_last_payload', '_ending', '_prompt')
+
+    def __init__(self, cog, id, arena_id, mode, members, winning_score, max_bans, created_at, *, edit_window=0):
+        self.cog = cog
+        self.loop = cog.bot.loop
+        self.id = id
+        self.journal = None
         self.arena_id = arena_id
         self.players = {}
+        self._active_count = 0
+        self._end_votes = 0
+        self.played = FighterSet()  # fighters by number of players that have played them
+        self.won = FighterSet()
+        self.banned = FighterSet()
+        self._description = None
+        self._embed = None
+        self._embed_key = None
+        self._archive = []  # messages with pages of rounds that no longer fit on the board, oldest first
+        self._archive_refs = []  # [[channel ID, message ID]] of the archive before `attach`
+        self._archive_sent = []  # (embed, payload) last sent to each archive message
+        self._archive_ranges = []  # (first round, end round) of each archive page
+        self._archive_embeds = {}  # {(first round, end round): embed}
+        self._live_start = 0  # first round on the board
         self.add_players(*members)
         self.mode = mode
         self.winning_score = winning_score
         self.max_bans = max_bans
         self.created_at = created_at
         self.message = None
+        self._message_ref = None  # [channel ID, message ID] before `attach`
+        self.edit_window = edit_window
+        self._pending_edit = None
+        self._last_edit = float('-inf')
+        self._waiting = []  # command invocations whose reply is the next board edit
+        self._last_embed = None
+        self._last_payload = None
         self._ending = False
-        self.__hide_rounds = 0
-        self._timer = None
-
-    def restart_timer(self):
-        if self._timer:
-            self._timer.cancel()
-        self._timer = self.loop.create_task(self.__inactivity_timer())
+        self._prompt = None
 
-    async def __inactivity_timer(self):
-        await asyncio.sleep(60 * 10)
+    def touch(self):
+        """Mark the game as active for the inactivity scheduler."""
+        self.cog.inactivity.touch(self)
 
-        confirmation = await self.send('Are you still playing?')
+    async def check_activity(self):
+        """Ask players whether they are still playing, ending the game if not."""
+        outbox = self.cog.outbox
+        channel_id = self.channel.id
+        confirmation = await outbox.submit(channel_id, Priority.PROMPT,
+                                           functools.partial(self.send, 'Are you still playing?'))
         emojis = ('\N{WHITE HEAVY CHECK MARK}', '\N{CROSS MARK}')
-        for emoji in emojis:
-            await confirmation.add_reaction(emoji)
         votes = set()
+        answer = self.loop.create_future()
 
-        def check(reaction, user):
-            if not (user in self.players and reaction.message.id == confirmation.id):
-                return False
-            elif reaction.emoji == emojis[0]:
-                return True
-            elif reaction.emoji == emojis[1] and user not in votes:
-                votes.add(user)
-                return len(votes) == self.votes_to_end
+        def on_reaction(payload):
+            if (answer.done() or payload.event_type != 'REACTION_ADD'
+                    or payload.user_id not in {m.id for m in self.players}):
+                return
+            emoji = str(payload.emoji)
+            if emoji == emojis[0]:
+                answer.set_result(emoji)
+            elif emoji == emojis[1] and payload.user_id not in votes:
+                votes.add(payload.user_id)
+                if len(votes) == self.votes_to_end:
+                    answer.set_result(emoji)
 
+        self.cog.reactions.add(confirmation.id, on_reaction)
         try:
-            reaction, user = await self.context.bot.wait_for('reaction_add', check=check, timeout=60)
+            for reaction in emojis:
+                await outbox.submit(channel_id, Priority.PROMPT, functools.partial(confirmation.add_reaction, reaction))
+            emoji = await asyncio.wait_for(answer, timeout=60)
         except asyncio.TimeoutError:
             await self.end(reason=EndReason.inactivity)
         else:
-            if reaction.emoji == emojis[1]:
+            if emoji == emojis[1]:
                 await self.end(reason=EndReason.vote)
         finally:
-            await confirmation.delete()
+            self.cog.reactions.remove(confirmation.id)
+            self._prompt = None
+            self.cog.deleter.add(confirmation)
             if not self._ending:
-                self.restart_timer()
+                self.cog.inactivity.add(self)
 
     @property
     def channel(self):
@@ -85,6 +131,33 @@ class Game:
     def send(self):
         return self.channel.send
 
+    @property
+    def arena_id(self):
+        return self.__arena_id
+
+    @arena_id.setter
+    def arena_id(self, value):
+        self.__arena_id = value
+        self.record('set', 'arena_id', value)
+
+    @property
+    def mode(self):
+        return self.__mode
+
+    @mode.setter
+    def mode(self, value):
+        self.__mode = value
+        self.record('set', 'mode', value.name.lower())
+
+    @property
+    def winning_score(self):
+        return self.__winning_score
+
+    @winning_score.setter
+    def winning_score(self, value):
+        self.__winning_score = value
+        self.record('set', 'winning_score', value)
+
     @property
     def max_bans(self):
         return self.__max_bans
@@ -93,100 +166,439 @@ class Game:
     def max_bans(self, maxlen):
         self.__max_bans = maxlen
         for player in self.players.values():
-            player.bans = deque(player.bans, maxlen)
+            player.set_max_bans(maxlen)
+        self.record('set', 'max_bans', maxlen)
+
+    def record(self, op, *args):
+        """Append a mutation of this game to the journal, if any."""
+        if self.journal is not None:
+            self.journal.record(self.id, op, *args)
+
+    def to_dict(self):
+        try:
+            message = [self.message.channel.id, self.message.id]
+        except AttributeError:
+            message = self._message_ref
+            archive = self._archive_refs
+        else:
+            archive = [[m.channel.id, m.id] for m in self._archive]
+        return {
+            'id': self.id,
+            'message': message,
+            'arena_id': self.arena_id,
+            'mode': self.mode.name.lower(),
+            'winning_score': self.winning_score,
+            'max_bans': self.max_bans,
+            'created_at': self.created_at.isoformat(),
+            'archive': archive,
+            'players': [p.to_dict() for p in self.players.values()],
+        }
+
+    @classmethod
+    def from_dict(cls, cog, data, *, edit_window=0):
+        """Rebuild a game from `to_dict`, with `discord.Object` standing in for members and no message.
+
+        Real members and the board message are attached by `attach`.
+        """
+        players = data['players']
+        members = [discord.Object(p['member']) for p in players]
+        self = cls(cog, data['id'], data['arena_id'], MODES[data['mode']], members, data['winning_score'],
+                   data['max_bans'], datetime.datetime.fromisoformat(data['created_at']), edit_window=edit_window)
+        for member, player_data in zip(members, players):
+            self.players[member].load(player_data)
+        self._message_ref = data['message']
+        self._archive_refs = data.get('archive', [])
+        return self
+
+    def attach(self, message, members, archive=()):
+        """Attach the board and `archive` messages and replace stand-in members with `members` ({id: member})."""
+        self.message = message
+        self._message_ref = None
+        self._archive = list(archive)
+        self._archive_refs = []
+        self._archive_sent = [None] * len(self._archive)  # unknown, so every page is edited once
+        players = {}
+        for player in self.players.values():
+            player.member = members[player.member.id]
+            players[player.member] = player
+        self.players = players
+        self._description = self._embed = None
+        self._rounds_changed()
+
+    def handoff(self):
+        """Stop this game's timers and return what `resume` needs to carry it on after the cog is reloaded."""
+        self._cancel_edit()
+        if self._prompt is not None:
+            self._prompt.cancel()
+            self._prompt = None
+        return {
+            'data': self.to_dict(),
+            'message': self.message,
+            'archive': list(self._archive),
+            'members': {m.id: m for m in self.players},
+            'payloads': [self._last_payload, *(None if sent is None else sent[1] for sent in self._archive_sent)],
+            'last_edit': self._last_edit,
+        }
+
+    @classmethod
+    def resume(cls, cog, state, *, edit_window=0):
+        """Rebuild a game from `handoff` with the reloaded classes, showing on the same messages."""
+        self = cls.from_dict(cog, state['data'], edit_window=edit_window)
+        self.attach(state['message'], state['members'], state['archive'])
+        self._last_payload, *archive = state['payloads']
+        self._archive_sent = [None if payload is None else (None, payload) for payload in archive]
+        self._last_edit = state['last_edit']
+        return self
+
+    def is_shown(self):
+        """Whether the board and archive show the current state, going by what was last sent to them.
+
+        After `resume` this is false if an edit was waiting or cancelled mid-request when the cog was unloaded.
+        """
+        pages = self.archive_embeds
+        if len(pages) != len(self._archive_sent):
+            return False
+        for page, sent in zip(pages, self._archive_sent):
+            if sent is None or (page is not sent[0] and page.to_dict() != sent[1]):
+                return False
+        return self._unchanged(self.embed)
+
+    def apply(self, op, *args):
+        """Replay a journaled mutation."""
+        if op == 'set':
+            attr, value = args
+            if attr == 'mode':
+                value = MODES[value]
+            setattr(self, attr, value)
+        elif op == 'add':
+            self.add_players(*(discord.Object(id) for id in args))
+        elif op == 'message':
+            self.message = None
+            self._message_ref = list(args)
+        elif op == 'archive':
+            self._archive = []
+            self._archive_refs = [list(ref) for ref in args]
+        else:
+            member_id, *args = args
+            player = self.players[discord.Object(member_id)]
+            player.apply(op, *args)
 
     @property
     def votes_to_end(self):
-        return sum(1 for p in self.players.values() if p.active) // 2 + 1
+        return self._active_count // 2 + 1
 
     @property
-    def embed(self):
-        e = discord.Embed()
-        title = self.mode.name
+    def end_votes(self):
+        return self._end_votes
+
+    def _render_description(self):
+        if self._description is None:
+            desc = [self.mode.description]
+            if self.max_bans:
+                desc.append(f'Max bans: {self.max_bans}')
+            bans = []
+            for m, p in self.players.items():
+                if p.bans:
+                    bans.append(f'**{m.display_name}**: {", ".join(f.name for f in p.bans)}')
+            if bans:
+                desc.append('**Bans:**')
+                desc.extend(bans)
+            self._description = '\n'.join(desc)
+        return self._description
+
+    def _rounds_changed(self, round_num=None):
+        """Lay out the archive again if `round_num` (or any round if `None`) is on or affects it."""
+        if round_num is None or round_num <= self._live_start:
+            self._archive_ranges = []
+            self._archive_embeds = {}
+            self._live_start = 0
+
+    @property
+    def title(self):
         if self.arena_id:
-            title = f'{title} - {self.arena_id}'
-        e.title = title
-        desc = [self.mode.description]
-        if self.max_bans:
-            desc.append(f'Max bans: {self.max_bans}')
-        bans = []
-        for m, p in self.players.items():
-            if p.bans:
-                bans.append(f'**{m.display_name}**: {", ".join(f.name for f in p.bans)}')
-        if bans:
-            desc.append('**Bans:**')
-            desc.extend(bans)
-        e.description = '\n'.join(desc)
+            return f'{self.mode.name} - {self.arena_id}'
+        return self.mode.name
+
+    def _fits(self, fixed, start, end=None):
+        """Whether rounds `start` to `end` fit on a page with `fixed` characters besides the field values."""
+        total = fixed
+        for player in self.players.values():
+            size = player.field_value_size(start, end)
+            if size > FIELD_SIZE:
+                return False
+            total += size
+        return total <= BOARD_SIZE
+
+    def _layout(self, board_size):
+        """Move the oldest rounds to archive pages until the rest fit on the board with `board_size` other characters.
+
+        Pages already laid out are kept, and each new page holds as many rounds as fit.
+        """
+        archive_size = len(self.title) + len(' - Rounds 999-999') + sum(len(m.name) + 4 for m in self.players)
+        last_round = max(len(p.rounds) for p in self.players.values()) - 1
+        start = self._live_start
+        while start < last_round and not self._fits(board_size, start):
+            low, high = start + 1, last_round
+            while low < high:
+                mid = (low + high + 1) // 2
+                if self._fits(archive_size, start, mid):
+                    low = mid
+                else:
+                    high = mid - 1
+            self._archive_ranges.append((start, low))
+            start = low
+        self._live_start = start
+
+    def _archive_embed(self, start, end):
+        embed = self._archive_embeds.get((start, end))
+        if embed is None:
+            embed = discord.Embed(title=f'{self.title} - Rounds {start + 1}-{end}')
+            for member, player in self.players.items():
+                embed.add_field(name=f'**{member.name}**', value=player.field_value(start, end))
+            self._archive_embeds[start, end] = embed
+        return embed
+
+    @property
+    def archive_embeds(self):
+        """Pages of the rounds that no longer fit on the board, oldest first."""
+        self.embed  # lays out the pages
+        return [self._archive_embed(start, end) for start, end in self._archive_ranges]
+
+    @property
+    def embed(self):
+        key = (self.mode, self.arena_id, self.winning_score, self.max_bans, self._ending)
+        if key != self._embed_key:
+            if self._embed_key is not None and key[:2] != self._embed_key[:2]:
+                self._rounds_changed()  # archive titles changed
+            self._embed_key = key
+            self._description = self._embed = None
+            for player in self.players.values():
+                player._field_changed(rounds=False)
+        if self._embed is not None:
+            return self._embed
+
+        title = self.title
+        if self.winning_score:
+            footer = f'First to {self.winning_score} wins! | Started'
+        else:
+            footer = 'Started'
+        description = self._render_description()
+        names = [p.field_name(m.name, self._ending, self.winning_score) for m, p in self.players.items()]
+        players = self.players.values()
+        self._layout(len(title) + len(footer) + len(description) + sum(len(n) for n in names))
+        start = self._live_start
+
+        e = discord.Embed(title=title, description=description)
         last_fighter, last_round = None, -1
-        for index, pair in enumerate(self.players.items()):
-            member, player = pair
-            win_count = player.wins
-            try:
-                latest_win = player.latest_win_round
-            except ValueError:
-                latest_win = -1
+        for name, player in zip(names, players):
+            latest_win = player.latest_win_round
             if latest_win > last_round:
-                last_fighter = player.rounds[latest_win].fighter
+                last_fighter = player.rounds.fighter(latest_win)
                 last_round = latest_win
-            if self._ending and win_count >= self.winning_score:
-                status = '\\\N{TROPHY}'
-            elif player.end:
-                status = '\\\N{CROSS MARK}'
-            else:
-                status = ''
-            name = '{active}**{name}**{active}\n{status}Wins: {wins}'.format(
-                name=member.name, wins=win_count, status=status,
-                active='' if player.active else '~~')
-            rounds = []
-            for ind, round_ in enumerate(player.rounds[self.__hide_rounds:], self.__hide_rounds):
-                rounds.append(f'{ind + 1}. {round_}')
-            e.add_field(name=name, value='\n'.join(rounds) or '\u200b')
-        if self.winning_score:
-            e.set_footer(text=f'First to {self.winning_score} wins! | Started')
-        else:
-            e.set_footer(text='Started')
+            e.add_field(name=name, value=player.field_value(start))
+        e.set_footer(text=footer)
         e.timestamp = self.created_at
         if last_round > -1:
             e.color = last_fighter.color
-        if len(e) > 5000:
-            self.__hide_rounds += 1
+        self._embed = e
         return e
 
-    async def update(self, *, embed=None, destination=None):
-        embed = embed or self.embed
+    async def update(self, *, embed=None, destination=None, flush=False):
+        """Show the current state of the game on the board.
+
+        Edits within `edit_window` seconds of the last are coalesced into one edit of the latest state
+        unless `flush` is set or a specific `embed` is given.
+        """
+        self._wait_for_edit()
         if destination:
-            old_msg = self.message
+            self._cancel_edit()
+            channel = getattr(destination, 'channel', destination)
             try:
-                self.message = await destination.send(embed=embed)
+                await self.cog.outbox.submit(channel.id, Priority.BOARD,
+                                             functools.partial(self._repost_now, destination, embed))
             except Exception as e:
-                await self.send(e, delete_after=5)
+                # in the game's own channel, as the bot may not be able to post in the destination
+                self.cog.notify(self.channel or channel, e)
+        elif embed is not None or flush or self.edit_window <= 0:
+            self._cancel_edit()
+            await self._edit(embed)
+        elif self._pending_edit is None:
+            delay = self._last_edit + self.edit_window - self.loop.time()
+            if delay <= 0:
+                await self._edit()
             else:
-                if old_msg:
-                    await old_msg.delete()
-        else:
-            await self.message.edit(embed=embed)
-        self.restart_timer()
+                self._pending_edit = self.loop.create_task(self._delayed_edit(delay))
+        if not self._ending:
+            self.touch()
+
+    def _wait_for_edit(self):
+        invocation = metrics.current()
+        if invocation is not None:
+            self._waiting.append(invocation)
+
+    def _replied(self):
+        """The board is up to date, so every command waiting on it has its reply."""
+        waiting, self._waiting = self._waiting, []
+        for invocation in waiting:
+            self.cog.bot.metrics.replied(invocation)
+
+    def _sent(self, embed):
+        self._last_embed = embed
+        self._last_payload = embed.to_dict()
+        self._last_edit = self.loop.time()
+        self._replied()
+
+    def _record_archive(self):
+        self.record('archive', *([m.channel.id, m.id] for m in self._archive))
+
+    async def _repost_now(self, destination, embed=None):
+        """Send the archive and board to `destination`, deleting the old ones."""
+        embed = embed or self.embed
+        old = [*self._archive, self.message]
+        archive = []
+        for page in self.archive_embeds:
+            archive.append(await destination.send(embed=page))
+        self.message = await destination.send(embed=embed)
+        self._archive = archive
+        self._archive_sent = [(page, page.to_dict()) for page in self.archive_embeds]
+        self.record('message', self.message.channel.id, self.message.id)
+        self._record_archive()
+        self._sent(embed)
+        for message in old:
+            if message is not None:
+                self.cog.deleter.add(message)
+
+    async def _edit(self, embed=None):
+        embed = embed or self.embed
+        if self._unchanged(embed) and self._archive_unchanged():
+            self._replied()
+            return
+        # rendered again when its turn comes, so an edit merged into one still queued shows the latest state
+        await self.cog.outbox.submit(self.channel.id, Priority.BOARD, functools.partial(self._edit_now, embed),
+                                     key=('board', self.id))
+
+    async def _edit_now(self, embed=None):
+        await self._edit_archive(self.archive_embeds)
+        embed = embed or self.embed
+        if self._unchanged(embed):
+            self._replied()
+            return
+        await self.message.edit(embed=embed)
+        self._sent(embed)
+
+    def _archive_unchanged(self):
+        pages = self.archive_embeds
+        return len(pages) == len(self._archive) and all(
+            sent is not None and page is sent[0] for page, sent in zip(pages, self._archive_sent))
+
+    async def _edit_archive(self, pages):
+        """Make the archive messages show `pages`, only editing those that changed."""
+        if len(pages) == len(self._archive) and self._archive_unchanged():
+            return
+        count = len(self._archive)
+        # the board moves down as pages fill, so it becomes the next page and the new board is sent below it
+        while len(self._archive) < len(pages):
+            page = pages[len(self._archive)]
+            await self.message.edit(embed=page)
+            self._archive.append(self.message)
+            self._archive_sent.append((page, page.to_dict()))
+            embed = self.embed
+            self.message = await self.channel.send(embed=embed)
+            self._sent(embed)
+            self.record('message', self.message.channel.id, self.message.id)
+        while len(self._archive) > len(pages):
+            self.cog.deleter.add(self._archive.pop())
+            self._archive_sent.pop()
+        if len(self._archive) != count:
+            self._record_archive()
+        for index, (message, page) in enumerate(zip(self._archive, pages)):
+            sent = self._archive_sent[index]
+            if sent is not None and page is sent[0]:
+                continue
+            payload = page.to_dict()
+            if sent is None or payload != sent[1]:
+                await message.edit(embed=page)
+            self._archive_sent[index] = (page, payload)
+
+    def _unchanged(self, embed):
+        """Whether the board already shows `embed`."""
+        if embed is not self._last_embed:
+            if embed.to_dict() != self._last_payload:
+                return False
+            self._last_embed = embed
+        return True
+
+    async def _delayed_edit(self, delay):
+        await asyncio.sleep(delay)
+        self._pending_edit = None
+        try:
+            await self._edit()
+        except discord.HTTPException:
+            logging.exception('Failed to edit game board.')
+
+    def _cancel_edit(self):
+        if self._pending_edit is not None:
+            self._pending_edit.cancel()
+            self._pending_edit = None
 
     def add_players(self, *members):
-        players = {member: Player(member, self) for member in members}
+        players = {member: Player(member, self) for member in members if member not in self.players}
         self.players.update(players)
+        if players:
+            self.record('add', *(m.id for m in players))
+        self._active_count += len(players)
+        self._embed = None
+        self._rounds_changed()
         return players
 
     def is_banned(self, fighter):
-        return any(p.has_banned(fighter) for p in self.players.values())
+        return fighter in self.banned
+
+    def summary(self, reason, winner=None):
+        """Describe the finished game for match history."""
+        ended_at = datetime.datetime.utcnow()
+        return {
+            'id': self.id,
+            'guild_id': self.channel.guild.id,
+            'channel_id': self.channel.id,
+            'mode': self.mode.name.lower(),
+            'winning_score': self.winning_score,
+            'max_bans': self.max_bans,
+            'started_at': self.created_at.isoformat(),
+            'ended_at': ended_at.isoformat(),
+            'duration': (ended_at - self.created_at).total_seconds(),
+            'end_reason': reason.name,
+            'winner_id': winner and winner.id,
+            'players': [{
+                'user_id': m.id,
+                'wins': p.wins,
+                'rounds': [(r.fighter.name, r.win, not isinstance(r.fighter, FakeFighter)) for r in p.rounds],
+                'bans': [f.name for f in p.bans],
+            } for m, p in self.players.items()],
+        }
 
     async def end(self, reason=EndReason.win):
         self._ending = True
-        if self._timer:
-            self._timer.cancel()
-        await self.update()
+        self.record('end')
+        winner = None
+        if reason is EndReason.win:
+            winner = max(self.players.items(), key=lambda p: p[1].wins)[0]
+        if self.cog.history is not None:
+            self.cog.history.add(self.summary(reason, winner))
+        self.cog.inactivity.discard(self)
+        if self._prompt is not None and self._prompt is not asyncio.current_task():
+            self._prompt.cancel()
+        await self.update(flush=True)
         mentions = ' '.join([m.mention for m in self.players])
         if reason is EndReason.vote:
-            await self.send(f'{mentions}\nThe game ended by majority vote.', delete_after=15)
+            result = f'{mentions}\nThe game ended by majority vote.'
         elif reason is EndReason.inactivity:
-            await self.send(f'{mentions}\nThe game ended due to inactivity.', delete_after=15)
+            result = f'{mentions}\nThe game ended due to inactivity.'
         else:
-            member, player = max(self.players.items(), key=lambda p: p[1].wins)
-            await self.send(f'{mentions}\n**{member.display_name} won!**', delete_after=15)
+            result = f'{mentions}\n**{winner.display_name} won!**'
+        message = await self.cog.outbox.submit(self.channel.id, Priority.BOARD, functools.partial(self.send, result))
+        self.cog.deleter.add(message, after=15)
         for m in self.players:
-            self.context.cog.players.pop(m, None)
+            self.cog.players.pop(m, None)
+            self.cog.bot.member_cache.release(m)
+        self.cog.registry.release(self.id)
@@ -1,10 +1,29 @@
+import asyncio
 import random
 
 from discord.ext import menus
 import discord
 
+from .fighter import Fighter
+
+ROSTER = tuple(Fighter.all())
+# FighterMenu's loop is a copy of this version's `menus.Menu._internal_loop`, which uses its private state
+MENUS_VERSION = '1.1'
+
 
 class FighterPageSource(menus.ListPageSource):
+    """Every fighter, paged.
+
+    Pages only depend on the roster, so their text is rendered once and shared by every menu.
+    """
+    __rendered = {}  # {per page: [page text]}
+
+    def __init__(self, per_page=20):
+        super().__init__(ROSTER, per_page=per_page)
+        self.rendered = self.__rendered.get(per_page)
+        if self.rendered is None:
+            self.rendered = self.__rendered[per_page] = self.render(per_page)
+
     @staticmethod
     def format_name(fighter):
         if fighter.aliases:
@@ -12,22 +31,72 @@ class FighterPageSource(menus.ListPageSource):
         else:
             return fighter.name
 
+    @classmethod
+    def render(cls, per_page):
+        latest = f'Latest fighter: {cls.format_name(ROSTER[-1])}\n\n'
+        return [latest + '\n'.join(f'{f.number}. {cls.format_name(f)}' for f in ROSTER[start:start + per_page])
+                for start in range(0, len(ROSTER), per_page)]
+
     async def format_page(self, menu, entries):
-        random_fighter = random.choice(entries)
-        embed = discord.Embed(title='Fighters', color=random_fighter.color)
-        fighters = '\n'.join(f'{f.number}. {self.format_name(f)}' for f in entries)
-        latest = self.entries[-1]
-        embed.description = f'Latest fighter: {self.format_name(latest)}\n\n{fighters}'
+        embed = discord.Embed(title='Fighters', color=random.choice(entries).color,
+                              description=self.rendered[menu.current_page])
         embed.set_footer(text=f'Page {menu.current_page + 1}/{self.get_max_pages()}')
         return embed
 
 
 class FighterMenu(menus.MenuPages):
+    """Pages that get their reactions from a `ReactionRouter` instead of waiting for every reaction event."""
+    def __init__(self, source, *, router, **kwargs):
+        super().__init__(source, **kwargs)
+        self.router = router
+        self._reactions = asyncio.Queue()
+
     async def start(self, ctx, *args, users=None, **kwargs):
         owner_ids = {ctx.bot.owner_id, *ctx.bot.owner_ids}
         self.users = (set(u.id for u in users) if users else {ctx.author.id}) | owner_ids
         await super().start(ctx, *args, **kwargs)
 
+    def _on_reaction(self, payload):
+        if self.reaction_check(payload):
+            self._reactions.put_nowait(payload)
+
+    async def _internal_loop(self):
+        # same as `menus.Menu._internal_loop`, but reading the queue the router fills
+        if menus.__version__ != MENUS_VERSION:  # its internals may have changed, so wait for reactions as usual
+            await super()._internal_loop()
+            return
+        timed_out = False
+        self.router.add(self.message.id, self._on_reaction)
+        try:
+            while self._running:
+                payload = await asyncio.wait_for(self._reactions.get(), self.timeout)
+                self.bot.loop.create_task(self.update(payload))
+        except asyncio.TimeoutError:
+            timed_out = True
+        finally:
+            self.router.remove(self.message.id)
+            self._event.set()
+            try:
+                await self.finalize(timed_out)
+            except Exception:
+                pass
+            if self.bot.is_closed():
+                return
+            try:
+                if self.delete_message_after:
+                    return await self.message.delete()
+                if self.clear_reactions_after:
+                    if self._can_remove_reactions:
+                        return await self.message.clear_reactions()
+                    me = discord.Object(id=self.bot.user.id)
+                    for button_emoji in self.buttons:
+                        try:
+                            await self.message.remove_reaction(button_emoji, me)
+                        except discord.HTTPException:
+                            continue
+            except Exception:
+                pass
+
     def reaction_check(self, payload):
         if payload.message_id != self.message.id:
             return False
@@ -1,5 +1,7 @@
 import inspect
 
+from .fighter import Fighter
+
 MODES = {}
 
 
@@ -24,6 +26,11 @@ def inject_help_modes(func):
 
 
 def mode(cls):
+    """Register a mode class.
+
+    Its checks take `pending`, the mask of fighters picked or banned earlier in the same command,
+    so several fighters can be checked together before any are applied.
+    """
     cls.name = name = cls.__name__
     MODES[name.lower()] = cls
 
@@ -33,14 +40,18 @@ class Smash:
     description = 'You may pick any fighter.'
 
     @staticmethod
-    def pick_check(player, fighter):
+    def pick_mask(player, pending=0):
+        return Fighter.all_mask & ~player.game.banned.mask
+
+    @staticmethod
+    def pick_check(player, fighter, pending=0):
         if player.game.is_banned(fighter):
             return CheckResult(False, f'{fighter} is banned.')
         return CheckResult(True)
 
     @staticmethod
-    def ban_check(player, fighter):
-        if player.game.is_banned(fighter):
+    def ban_check(player, fighter, pending=0):
+        if player.game.is_banned(fighter) or fighter.bit & pending:
             return CheckResult(False, f'{fighter} is already banned.')
         return CheckResult(True)
 
@@ -50,18 +61,23 @@ class Elimination:
     description = 'You may not pick any fighter you have already played.'
 
     @staticmethod
-    def pick_check(player, fighter):
-        if player.has_played(fighter):
+    def pick_mask(player, pending=0):
+        return Fighter.all_mask & ~(player.played.mask | player.game.banned.mask | pending)
+
+    @staticmethod
+    def pick_check(player, fighter, pending=0):
+        if player.has_played(fighter) or fighter.bit & pending:
             return CheckResult(False, f'You have already played {fighter}.')
         elif player.game.is_banned(fighter):
             return CheckResult(False, f'{fighter} is banned.')
         return CheckResult(True)
 
     @staticmethod
-    def ban_check(player, fighter):
-        if all(pl.has_played(fighter) for pl in player.game.players.values()):
+    def ban_check(player, fighter, pending=0):
+        game = player.game
+        if game.played.count(fighter) == len(game.players):
             return CheckResult(False, f'Everyone has already played {fighter}.')
-        elif player.game.is_banned(fighter):
+        elif game.is_banned(fighter) or fighter.bit & pending:
             return CheckResult(False, f'{fighter} is already banned.')
         return CheckResult(True)
 
@@ -71,21 +87,26 @@ class Smashdown:
     description = 'You may not pick any fighter that has already been played.'
 
     @staticmethod
-    def pick_check(player, fighter):
-        for plyr in player.game.players.values():
-            if plyr.has_played(fighter):
-                return CheckResult(False, f'{fighter} has already been played.')
-            elif plyr.has_banned(fighter):
-                return CheckResult(False, f'{fighter} is banned.')
+    def pick_mask(player, pending=0):
+        game = player.game
+        return Fighter.all_mask & ~(game.played.mask | game.banned.mask | pending)
+
+    @staticmethod
+    def pick_check(player, fighter, pending=0):
+        game = player.game
+        if fighter in game.played or fighter.bit & pending:
+            return CheckResult(False, f'{fighter} has already been played.')
+        elif game.is_banned(fighter):
+            return CheckResult(False, f'{fighter} is banned.')
         return CheckResult(True)
 
     @staticmethod
-    def ban_check(player, fighter):
-        for plyr in player.game.players.values():
-            if plyr.has_played(fighter):
-                return CheckResult(False, f'{fighter} has already been played.')
-            elif plyr.has_banned(fighter):
-                return CheckResult(False, f'{fighter} is already banned.')
+    def ban_check(player, fighter, pending=0):
+        game = player.game
+        if fighter in game.played:
+            return CheckResult(False, f'{fighter} has already been played.')
+        elif game.is_banned(fighter) or fighter.bit & pending:
+            return CheckResult(False, f'{fighter} is already banned.')
         return CheckResult(True)
 
 
@@ -94,23 +115,24 @@ class Smasharound:
     description = 'You may not pick any fighter that has already won.'
 
     @staticmethod
-    def pick_check(player, fighter):
+    def pick_mask(player, pending=0):
+        game = player.game
+        return Fighter.all_mask & ~(game.won.mask | game.banned.mask)
+
+    @staticmethod
+    def pick_check(player, fighter, pending=0):
         game = player.game
         if game.is_banned(fighter):
             return CheckResult(False, f'{fighter} is banned.')
-        for p in game.players.values():
-            for round_ in p.rounds:
-                if round_.win and round_.fighter == fighter:
-                    return CheckResult(False, f'{fighter} has already won.')
+        elif fighter in game.won:
+            return CheckResult(False, f'{fighter} has already won.')
         return CheckResult(True)
 
     @staticmethod
-    def ban_check(player, fighter):
+    def ban_check(player, fighter, pending=0):
         game = player.game
-        if game.is_banned(fighter):
+        if game.is_banned(fighter) or fighter.bit & pending:
             return CheckResult(False, f'{fighter} is already banned.')
-        for p in game.players.values():
-            for round_ in p.rounds:
-                if round_.win and round_.fighter == fighter:
-                    return CheckResult(False, f'{fighter} has already won.')
+        elif fighter in game.won:
+            return CheckResult(False, f'{fighter} has already won.')
         return CheckResult(True)
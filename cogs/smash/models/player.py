@@ -1,11 +1,14 @@
-from dataclasses import dataclass
 from collections import deque
+from bisect import bisect_left, insort
+from typing import NamedTuple
+from array import array
+import functools
 
 from .fighter import Fighter, FakeFighter
+from .fighterset import FighterSet
 
 
-@dataclass
-class Round:
+class Round(NamedTuple):
     fighter: Fighter
     win: bool = False
 
@@ -13,14 +16,116 @@ class Round:
         return '{1}{0}{1}'.format(self.fighter, '__' if self.win else '')
 
 
+class Rounds:
+    """A player's rounds, stored as parallel arrays of fighter index and win flag.
+
+    Reading gives `Round`s, which are snapshots, so changes go through the methods here.
+    """
+    __slots__ = ('_fighters', '_wins')
+
+    def __init__(self):
+        self._fighters = array('h')
+        self._wins = bytearray()
+
+    def __len__(self):
+        return len(self._fighters)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return Round(Fighter.by_index[self._fighters[index]], bool(self._wins[index]))
+
+    def __iter__(self):
+        by_index = Fighter.by_index
+        for index, win in zip(self._fighters, self._wins):
+            yield Round(by_index[index], bool(win))
+
+    def fighter(self, index):
+        return Fighter.by_index[self._fighters[index]]
+
+    def win(self, index):
+        return bool(self._wins[index])
+
+    def lines(self):
+        """Render each round as a numbered line for the board."""
+        names = {index: Fighter.by_index[index].name for index in set(self._fighters)}
+        return [f'{num}. __{names[index]}__' if win else f'{num}. {names[index]}'
+                for num, index, win in zip(range(1, len(self._fighters) + 1), self._fighters, self._wins)]
+
+    def append(self, fighter, count=1):
+        if count == 1:
+            self._fighters.append(fighter.index)
+            self._wins.append(0)
+        else:
+            self._fighters.extend([fighter.index] * count)
+            self._wins.extend(bytes(count))
+
+    def insert(self, index, fighter):
+        self._fighters.insert(index, fighter.index)
+        self._wins.insert(index, 0)
+
+    def pop(self, index):
+        fighter = self.fighter(index)
+        del self._fighters[index]
+        del self._wins[index]
+        return fighter
+
+    def set_fighter(self, index, fighter):
+        self._fighters[index] = fighter.index
+
+    def set_win(self, index, win):
+        self._wins[index] = win
+
+
+def checked(func):
+    """Decorator to verify aggregates against a full scan after `func` when `Player.debug` is set."""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        result = func(self, *args, **kwargs)
+        if self.debug:
+            self.check_aggregates()
+        return result
+    return wrapper
+
+
 class Player:
+    __slots__ = ('member', 'game', 'rounds', 'bans', 'end', '_active', '_win_rounds', 'played', 'won', 'banned',
+                 '_field_name', '_lines', '_line_ends', '_value')
+    debug = False
+
     def __init__(self, member, game):
         self.member = member
         self.game = game
-        self.rounds = []
+        self.rounds = Rounds()
         self.bans = deque()
         self.end = False
-        self.active = True
+        self._active = True
+        self._win_rounds = []  # sorted indices of won rounds
+        self.played = FighterSet()
+        self.won = FighterSet()
+        self.banned = FighterSet()
+        self._field_name = None
+        self._lines = None
+        self._line_ends = None  # total length of lines before each index
+        self._value = None  # (first round, end round, value)
+
+    @property
+    def active(self):
+        return self._active
+
+    @active.setter
+    @checked
+    def active(self, value):
+        value = bool(value)
+        if value is self._active:
+            return
+        self._active = value
+        self._field_changed(rounds=False)
+        self.record('active', value)
+        change = 1 if value else -1
+        self.game._active_count += change
+        if self.end:
+            self.game._end_votes += change
 
     @property
     def current_round(self):
@@ -28,75 +133,242 @@ class Player:
 
     @property
     def wins(self):
-        return sum(r.win for r in self.rounds)
+        return len(self._win_rounds)
 
     @property
     def latest_win_round(self):
-        for ind, round_ in enumerate(reversed(self.rounds), 1):
-            if round_.win:
-                return len(self.rounds) - ind
-        return -1
+        try:
+            return self._win_rounds[-1]
+        except IndexError:
+            return -1
+
+    def _shift_wins(self, round_num, amount):
+        """Shift indices of won rounds at or after `round_num` by `amount`."""
+        win_rounds = self._win_rounds
+        for ind in range(bisect_left(win_rounds, round_num), len(win_rounds)):
+            win_rounds[ind] += amount
+
+    def _field_changed(self, rounds=True, round_num=None):
+        """Clear cached rendering, with `round_num` the earliest round changed if only later ones were."""
+        self._field_name = None
+        if rounds:
+            self._lines = None
+            self._value = None
+            self.game._rounds_changed(round_num)
+        self.game._embed = None
+
+    def _bans_changed(self):
+        self.game._description = None
+        self.game._embed = None
+
+    def field_name(self, member_name, ending, winning_score):
+        if self._field_name is None:
+            if ending and self.wins >= winning_score:
+                status = '\\\N{TROPHY}'
+            elif self.end:
+                status = '\\\N{CROSS MARK}'
+            else:
+                status = ''
+            self._field_name = '{active}**{name}**{active}\n{status}Wins: {wins}'.format(
+                name=member_name, wins=self.wins, status=status,
+                active='' if self.active else '~~')
+        return self._field_name
+
+    def _render_lines(self):
+        if self._lines is None:
+            self._lines = lines = self.rounds.lines()
+            self._line_ends = ends = array('L', [0])
+            for line in lines:
+                ends.append(ends[-1] + len(line))
+        return self._lines
+
+    def field_value_size(self, start=0, end=None):
+        """Length of the field value showing rounds `start` to `end`, without joining it."""
+        count = len(self._render_lines())
+        end = count if end is None else min(end, count)
+        start = min(start, end)
+        if start == end:
+            return 1
+        return self._line_ends[end] - self._line_ends[start] + end - start - 1
+
+    def field_value(self, start=0, end=None):
+        """Rounds `start` to `end`, one per line. The latest is cached, as it's normally the same range."""
+        if self._value is None or self._value[:2] != (start, end):
+            self._value = (start, end, '\n'.join(self._render_lines()[start:end]) or '\u200b')
+        return self._value[2]
+
+    def check_aggregates(self):
+        """Compare incrementally maintained aggregates with a full scan of rounds and players."""
+        wins = [ind for ind, round_ in enumerate(self.rounds) if round_.win]
+        assert self._win_rounds == wins, f'win rounds {self._win_rounds} != {wins}'
+        players = self.game.players.values()
+        active = sum(1 for p in players if p.active)
+        assert self.game._active_count == active, f'active count {self.game._active_count} != {active}'
+        votes = sum(p.end for p in players if p.active)
+        assert self.game._end_votes == votes, f'end votes {self.game._end_votes} != {votes}'
+        played = {r.fighter.bit for r in self.rounds}
+        assert self.played.mask == sum(played), 'played mask out of sync'
+        won = {r.fighter.bit for r in self.rounds if r.win}
+        assert self.won.mask == sum(won), 'won mask out of sync'
+        banned = {f.bit for f in self.bans}
+        assert self.banned.mask == sum(banned), 'banned mask out of sync'
+
+    def _track(self, name, fighter, add=True):
+        """Add or remove `fighter` in this player's set `name`, updating the game's set of players with it."""
+        if add:
+            if getattr(self, name).add(fighter):
+                getattr(self.game, name).add(fighter)
+        elif getattr(self, name).remove(fighter):
+            getattr(self.game, name).remove(fighter)
+
+    def record(self, op, *args):
+        self.game.record(op, self.member.id, *args)
+
+    def to_dict(self):
+        return {
+            'member': self.member.id,
+            'rounds': [[r.fighter.name, r.win] for r in self.rounds],
+            'bans': [f.name for f in self.bans],
+            'end': self.end,
+            'active': self.active,
+        }
+
+    def load(self, data):
+        """Restore rounds, bans and votes from `to_dict`."""
+        for name, win in data['rounds']:
+            self.play(Fighter.get(name))
+            if win:
+                self.win()
+        for name in data['bans']:
+            self.ban(Fighter.get(name))
+        if data['end']:
+            self.vote_to_end()
+        self.active = data['active']
+
+    def apply(self, op, *args):
+        """Replay a journaled mutation."""
+        if op == 'play':
+            name, round_num = args
+            self.play(Fighter.get(name), round_num)
+        elif op == 'ban':
+            self.ban(Fighter.get(*args))
+        elif op == 'unban':
+            self.unban(Fighter.get(*args))
+        elif op == 'vote':
+            self.vote_to_end()
+        elif op == 'active':
+            self.active = args[0]
+        else:
+            getattr(self, op)(*args)
 
     def has_played(self, fighter):
-        if isinstance(fighter, FakeFighter):
-            return False
-        for round_ in self.rounds:
-            if round_.fighter == fighter:
-                return True
-        return False
+        return fighter in self.played
 
     def has_banned(self, fighter):
-        return fighter in self.bans
+        return fighter in self.banned
 
     def ban(self, fighter):
+        if self.bans.maxlen is not None and len(self.bans) == self.bans.maxlen:
+            if not self.bans.maxlen:
+                return
+            self._track('banned', self.bans[0], add=False)
         self.bans.append(fighter)
+        self._track('banned', fighter)
+        self._bans_changed()
+        self.record('ban', fighter.name)
 
     def unban(self, fighter):
         self.bans.remove(fighter)
+        self._track('banned', fighter, add=False)
+        self._bans_changed()
+        self.record('unban', fighter.name)
+
+    def set_max_bans(self, maxlen):
+        """Limit bans to `maxlen`, keeping only the most recent."""
+        bans = deque(self.bans, maxlen)
+        for fighter in list(self.bans)[:len(self.bans) - len(bans)]:
+            self._track('banned', fighter, add=False)
+        self.bans = bans
+        self._bans_changed()
 
+    @checked
     def vote_to_end(self):
         self.end = not self.end
+        self._field_changed(rounds=False)
+        self.record('vote')
+        if self._active:
+            self.game._end_votes += 1 if self.end else -1
 
+    @checked
     def play(self, fighter, round_num=None):
+        rounds = self.rounds
         if round_num is not None:
             round_diff = round_num - self.current_round
             if round_diff > 0:
-                self.rounds.extend(Round(FakeFighter('-')) for _ in range(round_diff))
-            if self.rounds[round_num].fighter.replace_on_insert:
-                self.rounds[round_num].fighter = fighter
+                rounds.append(FakeFighter('-'), round_diff)
+            current = rounds.fighter(round_num)
+            if current.replace_on_insert:
+                self._track('played', current, add=False)
+                if rounds.win(round_num):
+                    self._track('won', current, add=False)
+                    self._track('won', fighter)
+                rounds.set_fighter(round_num, fighter)
             else:
-                self.rounds.insert(round_num, Round(fighter))
+                round_num %= len(rounds)
+                rounds.insert(round_num, fighter)
+                self._shift_wins(round_num, 1)
+            changed = round_num % len(rounds)
         else:
-            self.rounds.append(Round(fighter))
+            rounds.append(fighter)
+            changed = len(rounds) - 1
+        self._track('played', fighter)
+        self._field_changed(round_num=changed)
+        self.record('play', fighter.name, round_num)
 
+    @checked
     def win(self, round_num=None):
         if round_num is None:
             round_num = self.current_round
+        rounds = self.rounds
         try:
-            round_ = self.rounds[round_num]
+            if rounds.win(round_num):
+                return False
         except IndexError:
             return False
         else:
-            if round_.win:
-                return False
-            round_.win = True
+            rounds.set_win(round_num, True)
+            insort(self._win_rounds, round_num % len(rounds))
+            self._track('won', rounds.fighter(round_num))
+            self._field_changed(round_num=round_num % len(rounds))
+            self.record('win', round_num)
             return True
 
+    @checked
     def undo(self, remove_action=None, round_num=None):
-        if not self.rounds:
+        rounds = self.rounds
+        if not rounds:
             return False
         if round_num is None:
             round_num = -1
-            round_ = self.rounds[round_num]
-            if remove_action is None and not round_.win:
+            won = rounds.win(round_num)
+            if remove_action is None and not won:
                 remove_action = 'play'
         else:
             try:
-                round_ = self.rounds[round_num]
+                won = rounds.win(round_num)
             except IndexError:
                 return False
+        round_num %= len(rounds)
+        fighter = rounds.fighter(round_num)
+        if won:
+            self._win_rounds.remove(round_num)
+            self._track('won', fighter, add=False)
         if remove_action == 'play':
-            self.rounds.pop(round_num)
+            rounds.pop(round_num)
+            self._shift_wins(round_num, -1)
+            self._track('played', fighter, add=False)
         else:
-            round_.win = False
+            rounds.set_win(round_num, False)
+        self._field_changed(round_num=round_num)
+        self.record('undo', remove_action, round_num)
         return True
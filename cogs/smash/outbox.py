@@ -0,0 +1,163 @@
+from enum import IntEnum
+import contextvars
+import itertools
+import asyncio
+import heapq
+import time
+
+import metrics
+
+MAX_PENDING = 20  # jobs queued per channel before stale ones are dropped
+
+
+class Priority(IntEnum):
+    BOARD = 0  # board sends and edits, end of game results
+    PROMPT = 1  # inactivity prompts
+    NOTICE = 2  # error notices that delete themselves
+    CLEANUP = 3  # deleting command messages and expired notices
+
+
+class Job:
+    __slots__ = ('priority', 'seq', 'func', 'key', 'max_age', 'queued_at', 'future', 'invocations')
+
+    def __init__(self, priority, seq, func, key, max_age, future):
+        self.priority = priority
+        self.seq = seq
+        self.func = func
+        self.key = key
+        self.max_age = max_age
+        self.queued_at = time.monotonic()
+        self.future = future
+        self.invocations = []  # commands this job is the reply to
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    @property
+    def stale(self):
+        return self.max_age is not None and time.monotonic() - self.queued_at > self.max_age
+
+
+class Outbox:
+    """Makes each channel's game requests one at a time, most important first.
+
+    Every request in a channel shares its rate limit, so rather than racing in arrival order,
+    board edits go ahead of prompts, notices and cleanup. A job submitted with the `key` of one
+    still waiting replaces its function, and both callers get the result of the one request.
+    Jobs with a `max_age` are dropped once they are older, or when too many jobs are waiting.
+    """
+    def __init__(self, loop, bot_metrics):
+        self.loop = loop
+        self.metrics = bot_metrics
+        self._queues = {}  # {channel ID: [Job] heap}
+        self._keys = {}  # {(channel ID, key): Job}
+        self._workers = {}  # {channel ID: task}
+        self._counter = itertools.count()
+        self.merged = bot_metrics.counter('smash_outbox_merged', 'Smash requests merged into one already queued.',
+                                          ('priority',))
+        self.dropped = bot_metrics.counter('smash_outbox_dropped', 'Smash requests dropped for being stale.',
+                                           ('priority',))
+        bot_metrics.gauge('smash_outbox_pending', 'Smash requests waiting to be made.', func=lambda: len(self))
+
+    def __len__(self):
+        return sum(len(q) for q in self._queues.values())
+
+    def submit(self, channel_id, priority, func, *, key=None, max_age=None):
+        """Queue the coroutine function `func` to be called in its turn, returning a future of its result.
+
+        The future's result is `None` if the job is dropped. Cancelling it doesn't cancel the job,
+        which may be shared with other callers.
+        """
+        invocation = metrics.current()
+        job = self._keys.get((channel_id, key)) if key is not None else None
+        if job is not None:
+            job.func = func
+            self.merged.inc(priority=priority.name.lower())
+        else:
+            job = Job(priority, next(self._counter), func, key, max_age, self.loop.create_future())
+            job.future.add_done_callback(_retrieve)
+            queue = self._queues.setdefault(channel_id, [])
+            heapq.heappush(queue, job)
+            if key is not None:
+                self._keys[channel_id, key] = job
+            if len(queue) > MAX_PENDING:
+                self._shed(channel_id)
+            if channel_id not in self._workers:
+                # not part of whichever command happened to start it
+                self._workers[channel_id] = contextvars.Context().run(self.loop.create_task, self._work(channel_id))
+        if invocation is not None:
+            job.invocations.append(invocation)
+        future = asyncio.shield(job.future)
+        future.add_done_callback(_retrieve)
+        return future
+
+    def close(self):
+        self.metrics.gauge('smash_outbox_pending', 'Smash requests waiting to be made.')
+        for task in self._workers.values():
+            task.cancel()
+        self._workers.clear()
+        for queue in self._queues.values():
+            for job in queue:
+                job.future.cancel()
+        self._queues.clear()
+        self._keys.clear()
+
+    def _forget(self, channel_id, job):
+        if job.key is not None and self._keys.get((channel_id, job.key)) is job:
+            del self._keys[channel_id, job.key]
+
+    def _drop(self, channel_id, job):
+        self._forget(channel_id, job)
+        self.dropped.inc(priority=job.priority.name.lower())
+        if not job.future.done():
+            job.future.set_result(None)
+
+    def _shed(self, channel_id):
+        """Drop the oldest of the least important jobs that may be dropped."""
+        queue = self._queues[channel_id]
+        droppable = [j for j in queue if j.max_age is not None]
+        if not droppable:
+            return
+        job = max(droppable, key=lambda j: (j.priority, -j.seq))
+        queue.remove(job)
+        heapq.heapify(queue)
+        self._drop(channel_id, job)
+
+    async def _work(self, channel_id):
+        queue = self._queues[channel_id]
+        try:
+            while queue:
+                job = heapq.heappop(queue)
+                if job.stale:
+                    self._drop(channel_id, job)
+                    continue
+                self._forget(channel_id, job)
+                if job.future.done():
+                    continue
+                start = time.perf_counter()
+                try:
+                    result = await job.func()
+                except asyncio.CancelledError:
+                    job.future.cancel()
+                    raise
+                except Exception as e:
+                    job.future.set_exception(e)
+                else:
+                    job.future.set_result(result)
+                    for invocation in job.invocations:
+                        self.metrics.replied(invocation)
+                elapsed = time.perf_counter() - start
+                for invocation in job.invocations:
+                    if invocation.finished_at is None:
+                        invocation.api += elapsed
+        finally:
+            if self._workers.get(channel_id) is asyncio.current_task():
+                del self._workers[channel_id]
+            if not queue and self._queues.get(channel_id) is queue:
+                del self._queues[channel_id]
+
+
+def _retrieve(future):
+    # errors are for whoever awaits the job, the rest don't care
+    if not future.cancelled():
+        future.exception()
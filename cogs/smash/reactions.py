@@ -0,0 +1,34 @@
+import logging
+
+
+class ReactionRouter:
+    """Routes raw reaction events to the handler registered for their message.
+
+    Handlers are plain callables taking the raw event payload, so an event is one dict lookup
+    no matter how many prompts and menus are open, instead of a `wait_for` check for each.
+    """
+    def __init__(self):
+        self._handlers = {}  # {message ID: handler}
+
+    def __len__(self):
+        return len(self._handlers)
+
+    def add(self, message_id, handler):
+        self._handlers[message_id] = handler
+
+    def take_over(self, other):
+        """Share `other`'s handlers, so prompts and menus it routes for keep working after a reload."""
+        self._handlers.update(other._handlers)
+        other._handlers = self._handlers
+
+    def remove(self, message_id):
+        self._handlers.pop(message_id, None)
+
+    def dispatch(self, payload):
+        handler = self._handlers.get(payload.message_id)
+        if handler is None:
+            return
+        try:
+            handler(payload)
+        except Exception:
+            logging.exception(f'Reaction handler for message {payload.message_id} failed.')
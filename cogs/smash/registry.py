@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import sqlite3
+import time
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS claims (
+    user_id INTEGER PRIMARY KEY,
+    game_id INTEGER NOT NULL,
+    owner TEXT NOT NULL,
+    claimed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS claims_game ON claims (game_id);
+CREATE INDEX IF NOT EXISTS claims_owner ON claims (owner);
+'''
+
+
+class Registry:
+    """Which game each member is in, so a member is only ever in one game.
+
+    Backends only need to be shared by every process that runs games.
+    """
+    async def claim(self, game_id, user_ids):
+        """Claim every member of `user_ids` not already in another game for `game_id`.
+
+        Returns the IDs that are in another game.
+        """
+        raise NotImplementedError
+
+    def release(self, game_id):
+        """Release every member of `game_id`. Does not wait for the backend."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryRegistry(Registry):
+    """Only knows about games in this process."""
+    def __init__(self):
+        self._games = {}  # {user ID: game ID}
+
+    async def claim(self, game_id, user_ids):
+        taken = set()
+        for user_id in user_ids:
+            if self._games.setdefault(user_id, game_id) != game_id:
+                taken.add(user_id)
+        return taken
+
+    def release(self, game_id):
+        for user_id in [u for u, g in self._games.items() if g == game_id]:
+            del self._games[user_id]
+
+
+class SQLiteRegistry(Registry):
+    """Shares claims between processes through an SQLite database.
+
+    Claims are tagged with `owner`, and an owner's stale claims are dropped when it starts,
+    so games lost to a crash don't lock their members out. Games restored from the journal claim
+    their members again.
+    """
+    def __init__(self, path, owner, loop):
+        self.path = path
+        self.owner = owner
+        self.loop = loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='smash-registry')
+        self._conn = None
+        self._executor.submit(self._connect)
+
+    def _connect(self):
+        # autocommit, so transactions are only what _claim begins itself
+        self._conn = conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        conn.execute('DELETE FROM claims WHERE owner = ?', (self.owner,))
+
+    def _run(self, func, *args):
+        return self.loop.run_in_executor(self._executor, func, *args)
+
+    def close(self):
+        self._executor.submit(self._close)
+        self._executor.shutdown(wait=False)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def claim(self, game_id, user_ids):
+        return await self._run(self._claim, game_id, list(user_ids))
+
+    def _claim(self, game_id, user_ids):
+        conn = self._conn
+        conn.execute('BEGIN IMMEDIATE')  # take the write lock first so no other process claims in between
+        try:
+            params = ','.join('?' * len(user_ids))
+            taken = {row[0] for row in conn.execute(
+                f'SELECT user_id FROM claims WHERE user_id IN ({params}) AND game_id != ?', (*user_ids, game_id))}
+            now = time.time()
+            conn.executemany('INSERT OR IGNORE INTO claims VALUES (?, ?, ?, ?)',
+                             [(u, game_id, self.owner, now) for u in user_ids if u not in taken])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return taken
+
+    def release(self, game_id):
+        future = self._run(self._release, game_id)
+        future.add_done_callback(self._log_failure)
+
+    def _release(self, game_id):
+        self._conn.execute('DELETE FROM claims WHERE game_id = ?', (game_id,))
+
+    @staticmethod
+    def _log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            exc = future.exception()
+            logging.error('Failed to release smash registry claims.', exc_info=(type(exc), exc, exc.__traceback__))
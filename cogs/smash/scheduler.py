@@ -0,0 +1,92 @@
+import asyncio
+import heapq
+import itertools
+
+
+class InactivityScheduler:
+    """Calls `callback(game)` once a game has gone `timeout` seconds, or its own timeout, without being touched.
+
+    Touching a game only records a timestamp. Deadlines live in a heap that is only
+    corrected when they come due, so one task serves every game.
+    """
+    def __init__(self, loop, callback, timeout):
+        self.loop = loop
+        self.callback = callback
+        self.timeout = timeout
+        self._heap = []  # [deadline, seq, game]
+        self._entries = {}  # {game: current heap entry}
+        self._last_active = {}  # {game: loop time}
+        self._timeouts = {}  # {game: seconds}, kept until discarded, for games not using the default
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._last_active)
+
+    def __contains__(self, game):
+        return game in self._last_active
+
+    def start(self):
+        if self._task is None:
+            self._task = self.loop.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _push(self, game, deadline):
+        entry = [deadline, next(self._counter), game]
+        self._entries[game] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._wakeup.set()
+
+    def add(self, game, timeout=None, *, last_active=None):
+        """Start tracking `game` as active at loop time `last_active`, or now, with its own `timeout` if given."""
+        if timeout is not None:
+            self._timeouts[game] = timeout
+        if last_active is None:
+            last_active = self.loop.time()
+        self._last_active[game] = last_active
+        self._push(game, last_active + self._timeouts.get(game, self.timeout))
+
+    def last_active(self, game):
+        """Loop time `game` was last touched, or `None` if it isn't tracked."""
+        return self._last_active.get(game)
+
+    def touch(self, game):
+        if game in self._last_active:
+            self._last_active[game] = self.loop.time()
+
+    def discard(self, game):
+        self._last_active.pop(game, None)
+        self._entries.pop(game, None)
+        self._timeouts.pop(game, None)
+
+    async def _run(self):
+        heap = self._heap
+        while True:
+            self._wakeup.clear()
+            if not heap:
+                await self._wakeup.wait()
+                continue
+            deadline, _, game = entry = heap[0]
+            delay = deadline - self.loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(heap)
+            if self._entries.get(game) is not entry:
+                continue
+            deadline = self._last_active[game] + self._timeouts.get(game, self.timeout)
+            if deadline > self.loop.time():
+                self._push(game, deadline)
+            else:
+                # keep its timeout, for when it's added back after asking if it's still active
+                del self._last_active[game], self._entries[game]
+                self.callback(game)
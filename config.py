@@ -0,0 +1,30 @@
+# Set any variable to `None` if not applicable.
+
+token = 'bot application token'
+activity = 'playing'  # playing listening watching
+activity_name = 'game name'
+prefix = ','
+sharded = False  # connect through multiple shards
+shard_count = None  # total shards when sharded, None to use Discord's recommendation
+shard_ids = None  # shards this process connects to when sharded, e.g. range(0, 4), None for all
+cluster_workers = None  # worker processes launcher.py starts, None for one per CPU
+
+members_intent = True  # privileged members intent, needed for member_chunking other than 'never'
+member_cache = 'all'  # members to cache: 'all', or to save memory 'games' (players), 'recent' (and recent authors)
+member_cache_ttl = 3600  # seconds the 'recent' member cache keeps members after their last message
+member_chunking = 'startup'  # request every guild's members: 'startup', 'lazy' (on a guild's first command), 'never'
+max_messages = 1000  # messages to cache, None to disable
+
+source = 'https://github.com/sgtlaggy/lagbot'
+metrics_file = 'metrics.prom'  # file to periodically write metrics to in Prometheus text format
+metrics_interval = 15  # seconds between writes of metrics_file
+app_info_cache = 'app_info.json'  # file to cache application info in, so owner commands work right after a restart
+settings_db = 'settings.db'  # SQLite database of per-guild settings like prefix, None to keep them only until restart
+
+# smash
+smash_edit_window = 1  # seconds to coalesce board edits over, 0 to edit on every action
+smash_delete_delay = 1  # seconds to collect command messages over before deleting them together
+smash_inactivity_timeout = 600  # seconds without activity before asking if a game is still being played
+smash_journal = 'smash.journal'  # file to journal games in progress to so they survive restarts
+smash_history = 'smash.db'  # SQLite database to save finished games and statistics to
+smash_registry = None  # SQLite database shared by cluster workers so members are only in one game, None for one process
@@ -3,60 +3,228 @@ import traceback
 import datetime
 import asyncio
 import logging
+import json
+import time
+import os
 
 from discord.ext import commands
 import discord
 import aiohttp
 
-from utils import UPPER_PATH, tb_args, pluralize, rzip
+from utils import UPPER_PATH, Timeline, tb_args, pluralize, rzip
+from membercache import MemberCache, CHUNKING
+from metrics import BotMetrics
+from settings import Settings
 import config
 
 Response = namedtuple('Response', 'status data')
 
-INTENTS = discord.Intents(members=True,  # priveleged
+INTENTS = discord.Intents(members=config.members_intent,  # priveleged
                           guilds=True,
                           messages=True,
                           reactions=True)
 
 
+def guild_prefix(bot, message):
+    """Mentioning the bot, or the prefix set for the message's guild, otherwise the one in config."""
+    prefix = config.prefix
+    if message.guild is not None:
+        prefix = bot.settings.get(message.guild.id, 'prefix', prefix)
+    return commands.when_mentioned_or(prefix)(bot, message)
+
+
 class LagBot(commands.Bot):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, startup=None, **kwargs):
+        if config.member_chunking not in CHUNKING:
+            raise ValueError(f'member_chunking must be one of {", ".join(CHUNKING)}, not {config.member_chunking!r}.')
         super().__init__(*args,
-                         command_prefix=commands.when_mentioned_or(config.prefix),
+                         command_prefix=guild_prefix,
                          help_command=commands.DefaultHelpCommand(command_attrs={'hidden': True}),
                          activity=discord.Activity(type=discord.ActivityType[config.activity],
                                                    name=config.activity_name),
                          intents=INTENTS,
+                         member_cache_flags=MemberCache.flags(config.member_cache, INTENTS),
+                         chunk_guilds_at_startup=config.member_chunking == 'startup',
+                         max_messages=config.max_messages,
                          **kwargs)
+        self.member_cache = MemberCache(self, config.member_cache, config.member_cache_ttl)
+        self.member_cache.start()
+        self._chunk_requested = set()  # guild IDs lazily chunked
         self.exit_status = 0
         useragent = 'Discord Bot'
         source = config.source
         if source is not None:
             useragent += ' ' + source
+        self.settings = Settings(config.settings_db, self.loop)
+        self.handoffs = {}  # {extension: state handed from its unloaded cog to the next one when reloading}
         self.http_ = aiohttp.ClientSession(loop=self.loop, headers={'User-Agent': useragent})
+        self.metrics = BotMetrics(self.loop)
+        self._time_api_requests()
+        self._metrics_tasks = [self.loop.create_task(self.metrics.sample_loop_lag())]
+        if config.metrics_file:
+            self._metrics_tasks.append(self.loop.create_task(self._write_metrics()))
+        self.startup = startup or Timeline()
+        self.metrics.gauge('startup_seconds', 'Seconds after the process started that each startup phase finished.',
+                           ('phase',), func=lambda: {(phase,): at for phase, at in self.startup})
+        self.add_listener(self._first_ready, 'on_socket_response')
+        self.app = None
+        self._app_info_task = None
+        self._load_app_info()
+
+    @property
+    def worker_name(self):
+        """Name of this process in a cluster, from the range of shards it runs, or `None` when it runs them all."""
+        shard_ids = getattr(self, 'shard_ids', None)
+        if not shard_ids or len(shard_ids) == self.shard_count:
+            return None
+        return f'{min(shard_ids)}-{max(shard_ids)}'
+
+    def worker_path(self, path):
+        """Make a local file `path` unique to this worker, so cluster workers don't share it."""
+        name = self.worker_name
+        return path if name is None else f'{path}.{name}'
 
     async def close(self):
         if self._closed:
             return
+        for task in self._metrics_tasks:
+            task.cancel()
+        self.member_cache.stop()
+        self.settings.close()
         await self.http_.close()
         await super().close()
 
+    def _time_api_requests(self):
+        """Count and time every Discord API request, and mark message sends/edits as command replies."""
+        request = self.http.request
+        replies = {'/channels/{channel_id}/messages', '/channels/{channel_id}/messages/{message_id}'}
+
+        async def timed_request(route, **kwargs):
+            start = time.perf_counter()
+            status = 'error'
+            try:
+                result = await request(route, **kwargs)
+            except discord.HTTPException as e:
+                status = str(e.status)
+                raise
+            else:
+                status = 'ok'
+                if route.method in {'POST', 'PATCH'} and route.path in replies:
+                    self.metrics.replied()
+                return result
+            finally:
+                self.metrics.api_request(route.method, route.path, status, time.perf_counter() - start)
+        self.http.request = timed_request
+
+    async def _write_metrics(self):
+        path = self.worker_path(config.metrics_file)
+        while True:
+            await asyncio.sleep(config.metrics_interval)
+            text = self.metrics.expose()
+            try:
+                await self.loop.run_in_executor(None, _write_atomic, path, text)
+            except OSError:
+                logging.exception(f'Failed writing metrics to "{path}".')
+
+    async def on_message(self, message):
+        self.member_cache.seen(message.author)
+        await self.process_commands(message)
+
+    async def get_prefix(self, message):
+        if not self.settings.loaded:  # only the first messages after starting wait
+            await self.settings.wait_until_loaded()
+        return await super().get_prefix(message)
+
+    async def invoke(self, ctx):
+        guild = ctx.guild
+        if config.member_chunking == 'lazy' and guild is not None and not guild.chunked \
+                and guild.id not in self._chunk_requested:
+            self._chunk_requested.add(guild.id)
+            self.loop.create_task(guild.chunk())
+        if ctx.command is None:
+            await super().invoke(ctx)
+            return
+        with self.metrics.invocation(ctx.command.qualified_name, 'prefix'):
+            await super().invoke(ctx)
+
     def run(self, *args, **kwargs):
         super().run(config.token, *args, **kwargs)
         return self.exit_status
 
+    async def login(self, *args, **kwargs):
+        await super().login(*args, **kwargs)
+        self.startup.mark('login')
+        if self._app_info_task is None:
+            self._app_info_task = self.loop.create_task(self._refresh_app_info())
+
+    async def _first_ready(self, msg):
+        if msg.get('t') == 'READY':
+            self.remove_listener(self._first_ready, 'on_socket_response')
+            self.startup.mark('gateway ready')
+
     async def on_ready(self):
         if hasattr(self, 'start_time'):
             return
         self.start_time = datetime.datetime.utcnow()
-        self.app = app = await self.application_info()
+        self.startup.mark('guilds ready')
+
+    def _load_app_info(self):
+        """Use application info cached by a previous run, so owner checks work without waiting on the API."""
+        path = config.app_info_cache
+        if not path:
+            return
+        try:
+            with open(path) as f:
+                self._set_app_info(json.load(f))
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _set_app_info(self, data):
+        self.app = app = discord.AppInfo(self._connection, data)
         if app.team:
+            self.owner_id = None
             self.owner_ids = {m.id for m in app.team.members}
         else:
             self.owner_id = app.owner.id
+            self.owner_ids = set()
+
+    async def _refresh_app_info(self):
+        data = await self.http.application_info()
+        self._set_app_info(data)
+        if config.app_info_cache:
+            try:
+                await self.loop.run_in_executor(None, _write_atomic, config.app_info_cache, json.dumps(data))
+            except OSError:
+                logging.exception('Failed caching application info.')
+
+    async def wait_for_app_info(self):
+        """Return application info, waiting for it if there is nothing cached yet."""
+        if self.app is None:
+            await asyncio.shield(self._app_info_task)
+        return self.app
+
+    def add_lazy_extension(self, name, *command_names):
+        """Load extension `name` the first time an owner invokes one of its `command_names`.
+
+        The first name is the command's name, the rest its aliases.
+        """
+        async def load(ctx):
+            self.remove_command(placeholder.name)
+            try:
+                self.load_extension(name)
+            except commands.ExtensionError:
+                self.add_command(placeholder)
+                raise
+            await self.process_commands(ctx.message)
+
+        placeholder = commands.Command(load, name=command_names[0], aliases=list(command_names[1:]), hidden=True,
+                                       checks=[commands.is_owner().predicate])
+        self.add_command(placeholder)
 
     async def on_command_error(self, ctx, exc):
         """Emulate default on_command_error and add guild + channel info."""
+        if ctx.command is not None:
+            self.metrics.error(ctx.command.qualified_name, exc)
         if hasattr(ctx.command, 'on_error') or getattr(exc, 'handled', False) or \
                 not isinstance(exc, commands.CommandInvokeError) or isinstance(exc.original, discord.Forbidden):
             return
@@ -79,6 +247,18 @@ class LagBot(commands.Bot):
         except asyncio.TimeoutError:
             return Response(None, None)
 
+    def shard_stats(self):
+        """Return `(shard ID, latency, guild count)` for every shard this process runs.
+
+        Unsharded bots report a single shard with ID `None`.
+        """
+        if not isinstance(self, discord.AutoShardedClient):
+            return [(None, self.latency, len(self.guilds))]
+        guilds = dict.fromkeys((shard_id for shard_id, _ in self.latencies), 0)
+        for guild in self.guilds:
+            guilds[guild.shard_id] = guilds.get(guild.shard_id, 0) + 1
+        return [(shard_id, latency, guilds[shard_id]) for shard_id, latency in self.latencies]
+
     def get_uptime(self, brief=False):
         now = datetime.datetime.utcnow()
         delta = now - self.start_time
@@ -95,11 +275,28 @@ class LagBot(commands.Bot):
             units = (('day', 'days'), ('hour', 'hours'), ('minute', 'minutes'), ('second', 'seconds'))
             joiner = ', '
 
-        for ind, time in enumerate((days, hours, minutes, seconds, None)):
-            if time:
+        for ind, amount in enumerate((days, hours, minutes, seconds, None)):
+            if amount:
                 fmt = fmt[ind:]
                 break
-            elif time is None:
+            elif amount is None:
                 fmt = [fmt[3]]
 
         return joiner.join(pluralize(*u, t, f) for u, t, f in rzip(units, (days, hours, minutes, seconds), fmt))
+
+
+def _write_atomic(path, text):
+    tmp = f'{path}.{os.getpid()}.tmp'  # cluster workers may write the same file
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class ShardedLagBot(LagBot, commands.AutoShardedBot):
+    """LagBot connecting through several shards, as set by `shard_count` and `shard_ids` in config."""
+    def __init__(self, *args, **kwargs):
+        if kwargs.get('shard_count') is None:  # bot.py passes None without --shard-count
+            kwargs['shard_count'] = config.shard_count
+        shard_ids = kwargs.get('shard_ids', config.shard_ids)
+        kwargs['shard_ids'] = None if shard_ids is None else list(shard_ids)
+        super().__init__(*args, **kwargs)
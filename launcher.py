@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Run the bot as a cluster of worker processes, each connecting a range of shards.
+
+Workers follow the exit codes of the `exit` command:
+0 stops the worker, 1 kills the whole cluster, 2 restarts the worker.
+Anything else is a crash, and the worker is restarted after a growing delay.
+"""
+import argparse
+import asyncio
+import logging
+import signal
+import sys
+import os
+
+import aiohttp
+
+import config
+
+BOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+IDENTIFY_DELAY = 5  # seconds Discord allows between shards identifying
+MAX_BACKOFF = 60
+STABLE_AFTER = 60  # seconds a worker has to run for its crash backoff to reset
+
+log = logging.getLogger('launcher')
+
+
+async def recommended_shards():
+    headers = {'Authorization': f'Bot {config.token}'}
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async with session.get('https://discord.com/api/v7/gateway/bot') as resp:
+            resp.raise_for_status()
+            return (await resp.json())['shards']
+
+
+def split_shards(shard_count, workers):
+    """Split shards into `workers` contiguous ranges as even as possible."""
+    workers = min(workers, shard_count)
+    size, extra = divmod(shard_count, workers)
+    ranges, start = [], 0
+    for index in range(workers):
+        end = start + size + (index < extra)
+        ranges.append(range(start, end))
+        start = end
+    return ranges
+
+
+class Worker:
+    def __init__(self, cluster, shard_ids, shard_count):
+        self.cluster = cluster
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.name = f'{shard_ids[0]}-{shard_ids[-1]}'
+        self.process = None
+
+    async def run(self, delay=0):
+        """Keep the worker running until it stops itself or the cluster stops."""
+        await asyncio.sleep(delay)
+        loop = asyncio.get_running_loop()
+        backoff = 1
+        while not self.cluster.stopping:
+            started = loop.time()
+            self.process = await asyncio.create_subprocess_exec(
+                sys.executable, BOT, '--shard-ids', self.name, '--shard-count', str(self.shard_count))
+            status = await self.process.wait()
+            self.process = None
+            if self.cluster.stopping:
+                return
+            if status == 0:
+                log.warning(f'Worker {self.name} stopped.')
+                return
+            elif status == 1:
+                log.critical(f'Worker {self.name} killed the cluster.')
+                self.cluster.stop(1)
+                return
+            elif status == 2:
+                log.warning(f'Worker {self.name} restarting.')
+                backoff = 1
+                continue
+            if loop.time() - started > STABLE_AFTER:
+                backoff = 1
+            log.error(f'Worker {self.name} exited with {status}, restarting in {backoff}s.')
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+    def terminate(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.terminate()
+
+
+class Cluster:
+    def __init__(self, shard_count, workers):
+        self.workers = [Worker(self, ids, shard_count) for ids in split_shards(shard_count, workers)]
+        self.stopping = False
+        self.status = 0
+
+    def stop(self, status=0):
+        if self.stopping:
+            return
+        self.stopping = True
+        self.status = status
+        for worker in self.workers:
+            worker.terminate()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+        delay = 0
+        runs = []
+        for worker in self.workers:
+            runs.append(worker.run(delay))
+            # each worker identifies its shards one at a time, so start the next when it is done
+            delay += IDENTIFY_DELAY * len(worker.shard_ids)
+        await asyncio.gather(*runs)
+        return self.status
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=config.cluster_workers,
+                        help='worker processes to run, defaults to one per CPU')
+    parser.add_argument('--shard-count', type=int, default=config.shard_count,
+                        help="total shards, defaults to Discord's recommendation")
+    args = parser.parse_args()
+
+    shard_count = args.shard_count or await recommended_shards()
+    workers = args.workers or os.cpu_count() or 1
+    cluster = Cluster(shard_count, workers)
+    log.warning(f'Starting {len(cluster.workers)} workers for {shard_count} shards.')
+    return await cluster.run()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    status = asyncio.run(main())
+    logging.shutdown()
+    sys.exit(status)
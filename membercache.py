@@ -0,0 +1,138 @@
+"""Member cache policies, for keeping only the members the bot actually uses.
+
+Policies, as `config.member_cache`:
+all     cache every member discord.py would, which with chunking is every member of every guild
+games   cache only members playing a game (or anything else that calls `keep`)
+recent  like games, plus members who sent a message in the last `config.member_cache_ttl` seconds
+
+discord.py has no hook to decide which members it caches, so for the last two it caches none
+and members are added to and removed from guild caches here.
+"""
+from collections import OrderedDict, Counter
+import itertools
+import asyncio
+import time
+
+import discord
+
+from utils import deep_sizeof
+
+POLICIES = ('all', 'games', 'recent')
+CHUNKING = ('startup', 'lazy', 'never')
+
+
+class MemberCache:
+    def __init__(self, bot, policy='all', ttl=3600):
+        if policy not in POLICIES:
+            raise ValueError(f'Member cache policy must be one of {", ".join(POLICIES)}, not {policy!r}.')
+        self.bot = bot
+        self.policy = policy
+        self.ttl = ttl
+        self._kept = Counter()  # {(guild ID, member ID): references}
+        self._seen = OrderedDict()  # {(guild ID, member ID): last seen}, oldest first
+        self._evict_task = None
+
+    @staticmethod
+    def flags(policy, intents):
+        """Member cache flags for the bot to be created with under `policy`."""
+        if policy == 'all':
+            return discord.MemberCacheFlags.from_intents(intents)
+        return discord.MemberCacheFlags.none()
+
+    @property
+    def tracking(self):
+        return self.policy != 'all'
+
+    def start(self):
+        if self.policy == 'recent' and self._evict_task is None:
+            self._evict_task = self.bot.loop.create_task(self._evict())
+
+    def stop(self):
+        if self._evict_task is not None:
+            self._evict_task.cancel()
+            self._evict_task = None
+
+    def keep(self, member):
+        """Cache `member` until it is `release`d as many times as it was kept."""
+        if not self.tracking or not isinstance(member, discord.Member):
+            return
+        self._kept[member.guild.id, member.id] += 1
+        member.guild._add_member(member)
+
+    def release(self, member):
+        if not self.tracking or not isinstance(member, discord.Member):
+            return
+        key = member.guild.id, member.id
+        self._kept[key] -= 1
+        if self._kept[key] <= 0:
+            del self._kept[key]
+            if key not in self._seen:
+                self._uncache(member.guild, member.id)
+
+    def seen(self, member):
+        """Note that `member` was active, keeping it cached for `ttl` seconds under the recent policy."""
+        if self.policy != 'recent' or not isinstance(member, discord.Member):
+            return
+        key = member.guild.id, member.id
+        self._seen[key] = time.monotonic()
+        self._seen.move_to_end(key)
+        if member.guild.get_member(member.id) is None:
+            member.guild._add_member(member)
+
+    def _uncache(self, guild, member_id):
+        member = guild.get_member(member_id)
+        if member is not None and member_id != self.bot.user.id:
+            guild._remove_member(member)
+
+    async def _evict(self):
+        while True:
+            await asyncio.sleep(max(self.ttl / 4, 1))
+            cutoff = time.monotonic() - self.ttl
+            while self._seen:
+                key, seen = next(iter(self._seen.items()))
+                if seen > cutoff:
+                    break
+                del self._seen[key]
+                if key in self._kept:
+                    continue
+                guild = self.bot.get_guild(key[0])
+                if guild is not None:
+                    self._uncache(guild, key[1])
+
+
+def _sampled_size(objects, count, sample, seen):
+    """Estimate the size of `count` objects from the first `sample` of them."""
+    measured = 0
+    size = 0
+    for obj in itertools.islice(objects, sample):
+        size += deep_sizeof(obj, seen)
+        measured += 1
+    return size * count // measured if measured else 0
+
+
+def memory_report(bot, sample=1000):
+    """Approximate memory held by the member, message and guild caches as `[(name, count, bytes)]`.
+
+    Each cache is estimated from up to `sample` of its objects. Objects shared between caches
+    are counted in the first, in the order members, users, messages, guilds.
+    """
+    state = bot._connection
+    guilds = list(bot.guilds)
+    channels = [c for g in guilds for c in g.channels]
+    seen = {id(bot), id(state), id(bot.http), id(bot.loop)}
+    # guilds and their channels are counted last, not as part of whatever references them
+    structure = {id(o) for o in itertools.chain(guilds, channels)}
+    seen |= structure
+    report = []
+
+    members = [m for g in guilds for m in g._members.values()]
+    report.append(('members', len(members), _sampled_size(members, len(members), sample, seen)))
+    users = list(state._users.values())
+    report.append(('users', len(users), _sampled_size(users, len(users), sample, seen)))
+    messages = list(state._messages or ())
+    report.append(('messages', len(messages), _sampled_size(reversed(messages), len(messages), sample, seen)))
+    # objects beyond the samples were already estimated, don't walk them as part of guilds
+    seen.update(id(o) for o in itertools.chain(members, users, messages))
+    seen -= structure
+    report.append(('guilds', len(guilds), _sampled_size(guilds, len(guilds), sample, seen)))
+    return report
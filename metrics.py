@@ -0,0 +1,266 @@
+"""In-process metrics with Prometheus text exposition.
+
+Commands are timed through an `Invocation` kept in a context variable, so API requests made
+while handling a command (including from tasks it starts) are attributed to it.
+"""
+from contextlib import contextmanager
+from collections import defaultdict
+import contextvars
+import asyncio
+import bisect
+import math
+import time
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+_current = contextvars.ContextVar('invocation', default=None)
+
+
+def current():
+    """Return the `Invocation` being handled in this context, if any."""
+    return _current.get()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{v}"' for n, v in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def samples(self):
+        """Yield `(suffix, label values, extra labels, value)` for exposition."""
+        raise NotImplementedError
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} {self.type}']
+        for suffix, values, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(self.labels, values, extra)} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values = defaultdict(int)
+
+    def inc(self, amount=1, **labels):
+        self.values[self._key(labels)] += amount
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+    def total(self):
+        return sum(self.values.values())
+
+    def samples(self):
+        for values, value in sorted(self.values.items()):
+            yield '', values, (), value
+
+
+class Gauge(Metric):
+    """A gauge that is either set directly or read from `func` when exposed.
+
+    `func` returns a number, or a dict of `{label values: number}` for labelled gauges.
+    """
+    type = 'gauge'
+
+    def __init__(self, *args, func=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.func = func
+        self.values = {}
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def read(self):
+        if self.func is None:
+            return dict(self.values)
+        value = self.func()
+        return value if isinstance(value, dict) else {(): value}
+
+    def samples(self):
+        for values, value in sorted(self.read().items()):
+            yield '', values, (), value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, *args, buckets=DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.counts = {}  # {label values: [count per bucket]}
+        self.sums = defaultdict(float)
+        self.maxes = defaultdict(float)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * len(self.buckets)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[key] += value
+        if value > self.maxes[key]:
+            self.maxes[key] = value
+
+    def count(self, **labels):
+        return sum(self.counts.get(self._key(labels), ()))
+
+    def max(self, **labels):
+        return self.maxes.get(self._key(labels), 0.0)
+
+    def quantile(self, q, **labels):
+        """Estimate the `q` quantile by interpolating within its bucket, like Prometheus does."""
+        counts = self.counts.get(self._key(labels))
+        if not counts:
+            return None
+        rank = q * sum(counts)
+        seen = 0
+        for index, count in enumerate(counts):
+            if seen + count >= rank and count:
+                upper = self.buckets[index]
+                lower = self.buckets[index - 1] if index else 0.0
+                if upper == math.inf:
+                    return self.maxes[self._key(labels)]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.maxes[self._key(labels)]
+
+    def keys(self):
+        return sorted(self.counts)
+
+    def samples(self):
+        for values in sorted(self.counts):
+            cumulative = 0
+            for bound, count in zip(self.buckets, self.counts[values]):
+                cumulative += count
+                yield '_bucket', values, (('le', _format_value(bound)),), cumulative
+            yield '_sum', values, (), self.sums[values]
+            yield '_count', values, (), cumulative
+
+
+class Registry:
+    """Holds metrics by name. Registering an existing name returns the existing metric,
+    so extensions can register theirs again when reloaded.
+    """
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self.metrics = {}
+
+    def _register(self, cls, name, doc, labels=(), **kwargs):
+        name = self.prefix + name
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = cls(name, doc, labels, **kwargs)
+        return metric
+
+    def counter(self, name, doc, labels=()):
+        return self._register(Counter, name + '_total', doc, labels)
+
+    def histogram(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, doc, labels, buckets=buckets)
+
+    def gauge(self, name, doc, labels=(), func=None):
+        gauge = self._register(Gauge, name, doc, labels)
+        gauge.func = func
+        return gauge
+
+    def expose(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        return '\n'.join(m.expose() for m in self.metrics.values()) + '\n'
+
+
+class Invocation:
+    """Timing of a single command being handled."""
+    __slots__ = ('name', 'via', 'start', 'task', 'api', 'replied_at', 'finished_at')
+
+    def __init__(self, name, via):
+        self.name = name
+        self.via = via
+        self.start = time.perf_counter()
+        self.task = asyncio.current_task()
+        self.api = 0.0  # seconds the command's own task spent waiting on the API
+        self.replied_at = None
+        self.finished_at = None
+
+
+class BotMetrics(Registry):
+    """The metrics every bot has. Extensions register their own on the same registry."""
+    def __init__(self, loop):
+        super().__init__('lagbot_')
+        self.loop = loop
+        self.commands = self.counter('commands', 'Commands invoked.', ('command', 'via'))
+        self.errors = self.counter('command_errors', 'Commands that raised an error.', ('command', 'error'))
+        self.reply_seconds = self.histogram(
+            'command_reply_seconds', 'Time from invoking a command until its reply or edit was sent.',
+            ('command', 'via'))
+        self.own_seconds = self.histogram(
+            'command_own_seconds', 'Time spent handling a command, excluding waiting on the Discord API.',
+            ('command', 'via'))
+        self.api_requests = self.counter('api_requests', 'Discord API requests.', ('method', 'route', 'status'))
+        self.api_seconds = self.histogram('api_request_seconds', 'Discord API request duration.',
+                                          ('method', 'route'))
+        self.loop_lag = self.histogram('loop_lag_seconds', 'How late the event loop ran a scheduled callback.')
+        self.gauge('tasks', 'Pending asyncio tasks.', func=lambda: len(asyncio.all_tasks(self.loop)))
+
+    @contextmanager
+    def invocation(self, name, via):
+        """Time handling the command `name` invoked `via` a prefix or short name."""
+        invocation = Invocation(name, via)
+        token = _current.set(invocation)
+        self.commands.inc(command=name, via=via)
+        try:
+            yield invocation
+        finally:
+            _current.reset(token)
+            invocation.finished_at = time.perf_counter()
+            elapsed = invocation.finished_at - invocation.start
+            self.own_seconds.observe(max(0.0, elapsed - invocation.api), command=name, via=via)
+
+    def replied(self, invocation=None):
+        """Mark the reply to `invocation` (or the current one) as sent. Only the first counts."""
+        invocation = invocation or current()
+        if invocation is None or invocation.replied_at is not None:
+            return
+        invocation.replied_at = time.perf_counter()
+        self.reply_seconds.observe(invocation.replied_at - invocation.start,
+                                   command=invocation.name, via=invocation.via)
+
+    def error(self, name, exc):
+        self.errors.inc(command=name, error=type(getattr(exc, 'original', exc)).__name__)
+
+    def api_request(self, method, route, status, elapsed):
+        self.api_requests.inc(method=method, route=route, status=status)
+        self.api_seconds.observe(elapsed, method=method, route=route)
+        invocation = current()
+        if invocation is not None and invocation.finished_at is None and invocation.task is asyncio.current_task():
+            invocation.api += elapsed
+
+    async def sample_loop_lag(self, interval=0.5):
+        while True:
+            start = self.loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag.observe(max(0.0, self.loop.time() - start - interval))
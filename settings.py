@@ -0,0 +1,132 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import asyncio
+import sqlite3
+import json
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS guild_settings (
+    guild_id INTEGER,
+    key TEXT,
+    value TEXT NOT NULL,
+    PRIMARY KEY (guild_id, key)
+);
+'''
+
+
+class Settings:
+    """Per-guild settings, such as the command prefix, cached in memory and saved to SQLite.
+
+    Every guild's settings are read into the cache by a worker thread when the bot starts, so
+    reading them never waits on the disk. Changes apply to the cache immediately and are written
+    in the background, in the order they were made. Without a `path` they last until restart.
+    """
+    def __init__(self, path, loop):
+        self.path = path
+        self.loop = loop
+        self._cache = {}  # {guild ID: {key: value}}
+        self._conn = None
+        if path:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='settings')
+            self._loaded = self._run(self._load)
+            self._loaded.add_done_callback(self._merge)
+        else:
+            self._executor = None
+            self._loaded = loop.create_future()
+            self._loaded.set_result([])
+
+    @property
+    def loaded(self):
+        return self._loaded.done()
+
+    async def wait_until_loaded(self):
+        await asyncio.shield(self._loaded)
+
+    def _run(self, func, *args):
+        return self.loop.run_in_executor(self._executor, func, *args)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.submit(self._close)
+            self._executor.shutdown(wait=False)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _load(self):
+        # cluster workers may share the file, each writing only its own guilds
+        self._conn = conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        return conn.execute('SELECT guild_id, key, value FROM guild_settings').fetchall()
+
+    def _merge(self, future):
+        if future.cancelled():
+            return
+        exc = future.exception()
+        if exc is not None:
+            logging.error(f'Failed loading settings from "{self.path}".', exc_info=(type(exc), exc, exc.__traceback__))
+            return
+        for guild_id, key, value in future.result():
+            # anything set while loading is newer, and is written after the load
+            self._cache.setdefault(guild_id, {}).setdefault(key, json.loads(value))
+
+    def get(self, guild_id, key, default=None):
+        try:
+            return self._cache[guild_id][key]
+        except KeyError:
+            return default
+
+    def guild(self, guild_id):
+        """Get a copy of every setting `guild_id` has changed."""
+        return dict(self._cache.get(guild_id, ()))
+
+    def set(self, guild_id, key, value):
+        """Change a setting, or reset it to the default with `None`."""
+        if value is None:
+            guild = self._cache.get(guild_id)
+            if guild is None or guild.pop(key, None) is None:
+                return
+            if not guild:
+                del self._cache[guild_id]
+        else:
+            self._cache.setdefault(guild_id, {})[key] = value
+        self._write(self._save, guild_id, key, value)
+
+    def reset(self, guild_id, prefix=''):
+        """Reset every setting of `guild_id` whose key starts with `prefix`."""
+        guild = self._cache.get(guild_id)
+        if not guild:
+            return
+        for key in [k for k in guild if k.startswith(prefix)]:
+            del guild[key]
+        if not guild:
+            del self._cache[guild_id]
+        self._write(self._reset, guild_id, prefix)
+
+    def _write(self, func, *args):
+        if self._executor is None:
+            return
+        future = self._run(func, *args)
+        future.add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            exc = future.exception()
+            logging.error('Failed to save settings.', exc_info=(type(exc), exc, exc.__traceback__))
+
+    def _save(self, guild_id, key, value):
+        with self._conn as conn:
+            if value is None:
+                conn.execute('DELETE FROM guild_settings WHERE guild_id = ? AND key = ?', (guild_id, key))
+            else:
+                conn.execute('INSERT OR REPLACE INTO guild_settings VALUES (?, ?, ?)',
+                             (guild_id, key, json.dumps(value)))
+
+    def _reset(self, guild_id, prefix):
+        with self._conn as conn:
+            conn.execute("DELETE FROM guild_settings WHERE guild_id = ? AND substr(key, 1, ?) = ?",
+                         (guild_id, len(prefix), prefix))
@@ -0,0 +1,53 @@
+"""Stand-ins for Discord and the cog shared by the tests."""
+from types import SimpleNamespace
+import importlib.machinery
+import importlib.util
+import asyncio
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    import config  # NOQA
+except ImportError:  # the cog needs a config
+    path = os.path.join(ROOT, 'config.py.example')
+    spec = importlib.util.spec_from_loader('config', importlib.machinery.SourceFileLoader('config', path))
+    sys.modules['config'] = config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(config)
+
+
+class FakeMember:
+    def __init__(self, id):
+        self.id = id
+        self.name = self.display_name = f'Player {id}'
+        self.mention = f'<@{id}>'
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id
+
+
+class FakeOutbox:
+    """Never makes its requests, so whatever awaits them stays waiting."""
+    def __init__(self, loop):
+        self.loop = loop
+
+    def submit(self, channel_id, priority, func, **kwargs):
+        return self.loop.create_future()
+
+
+def fake_cog():
+    """Enough of `Smash` for games to run on the current loop."""
+    loop = asyncio.get_running_loop()
+    return SimpleNamespace(bot=SimpleNamespace(loop=loop), players={}, history=None, journal=None, _restoring=[],
+                           inactivity=SimpleNamespace(add=lambda *a, **k: None, touch=lambda g: None,
+                                                      discard=lambda g: None),
+                           outbox=FakeOutbox(loop))
+
+
+def fake_message(id, channel_id=1):
+    return SimpleNamespace(id=id, channel=SimpleNamespace(id=channel_id))
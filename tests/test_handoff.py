@@ -0,0 +1,29 @@
+"""Handing games from an unloaded Smash cog to the reloaded one."""
+import unittest
+import datetime
+
+from fakes import FakeMember, fake_cog, fake_message
+from cogs.smash.models import Game, Fighter, MODES
+
+
+class HandoffTest(unittest.IsolatedAsyncioTestCase):
+    def make_game(self):
+        members = [FakeMember(i) for i in range(2)]
+        game = Game(fake_cog(), 1, None, MODES['smash'], members, 0, None, datetime.datetime(2020, 1, 1))
+        game.message = fake_message(100)
+        for player in game.players.values():
+            player.play(Fighter.get('Mario'))
+        game._sent(game.embed)  # as if the board was last edited now
+        return game
+
+    async def test_resume_shown(self):
+        game = self.make_game()
+        resumed = Game.resume(fake_cog(), game.handoff())
+        self.assertTrue(resumed.is_shown())
+
+    async def test_resume_behind(self):
+        # the board edit for this pick was still queued, so it's cancelled with the old cog's outbox
+        game = self.make_game()
+        next(iter(game.players.values())).play(Fighter.get('Link'))
+        resumed = Game.resume(fake_cog(), game.handoff())
+        self.assertFalse(resumed.is_shown())
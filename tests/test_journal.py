@@ -0,0 +1,67 @@
+"""Journal snapshots and replay of smash games.
+
+Run with `python -m unittest discover tests`.
+"""
+from types import SimpleNamespace
+import tempfile
+import unittest
+import asyncio
+import datetime
+import os
+
+from fakes import FakeMember, fake_cog, fake_message
+from cogs.smash.models import Game, Fighter, MODES, EndReason
+from cogs.smash.journal import Journal
+from cogs.smash.cog import Smash
+
+
+class JournalTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'smash.journal')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def fake_cog(self):
+        cog = fake_cog()
+        cog.journal = Journal(self.path, lambda: Smash._dump_games(SimpleNamespace(
+            games={p.game for p in cog.players.values()}, _restoring=cog._restoring)))
+        return cog
+
+    def replay(self):
+        cog = self.fake_cog()
+        Smash._load_journal(cog)
+        return cog._restoring
+
+    def start_game(self, cog, game_id):
+        members = [FakeMember(game_id * 10 + i) for i in range(2)]
+        game = Game(cog, game_id, None, MODES['smash'], members, 0, None, datetime.datetime(2020, 1, 1))
+        game.message = fake_message(game_id + 100)
+        game.journal = cog.journal
+        cog.players.update(game.players)
+        game.record('new', game.to_dict())
+        return game
+
+    async def test_snapshot_while_ending(self):
+        cog = self.fake_cog()
+        cog.journal.open()
+        ending = self.start_game(cog, 1)
+        other = self.start_game(cog, 2)
+        for game in (ending, other):
+            for player in game.players.values():
+                player.play(Fighter.get('Mario'))
+        end = asyncio.ensure_future(ending.end(reason=EndReason.vote))
+        await asyncio.sleep(0)  # journaled 'end', now waiting on the board flush
+        self.assertIn(next(iter(ending.players)), cog.players)
+        cog.journal.snapshot()
+        cog.journal.close()
+        end.cancel()
+
+        restored = self.replay()
+        self.assertEqual([g.id for g in restored], [other.id])
+        self.assertEqual([len(p.rounds) for p in restored[0].players.values()], [1, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
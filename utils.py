@@ -1,3 +1,7 @@
+from collections import deque
+import types
+import time
+import sys
 import os
 
 UPPER_PATH = os.path.split(os.path.abspath(__file__))[0]
@@ -56,3 +60,60 @@ def clamp(value, low=None, high=None):
     elif high is not None and value > high:
         value = high
     return value
+
+
+class Timeline:
+    """Records how long after `start` each named phase finished.
+
+    `start` is a `time.perf_counter()` value, defaulting to now.
+    """
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.phases = []  # [(phase, seconds since start)]
+
+    def mark(self, phase):
+        self.phases.append((phase, time.perf_counter() - self.start))
+
+    def __iter__(self):
+        return iter(self.phases)
+
+
+_SKIP_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+               types.CodeType, types.FrameType)
+_ATOMIC_TYPES = (str, bytes, int, float, bool, type(None))
+
+
+def deep_sizeof(obj, seen=None):
+    """Approximate bytes held by `obj` and everything it references.
+
+    Objects whose IDs are in `seen` are not counted, and everything counted is added to it, so
+    sharing `seen` between calls counts shared objects once. Add objects that should not be
+    counted, like the bot or connection state, to `seen` beforehand.
+    """
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _SKIP_TYPES):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, _ATOMIC_TYPES):
+            continue
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        else:
+            attrs = getattr(obj, '__dict__', None)
+            if attrs is not None:
+                stack.append(attrs)
+            for cls in type(obj).__mro__:
+                slots = cls.__dict__.get('__slots__', ())
+                for slot in (slots,) if isinstance(slots, str) else slots:
+                    value = getattr(obj, slot, None)
+                    if value is not None:
+                        stack.append(value)
+    return size